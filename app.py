@@ -5,28 +5,27 @@ from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import faiss
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
 from langdetect import detect, LangDetectException
 from transformers import pipeline
 from pathlib import Path
 import uvicorn
 import torch
 import json
-import threading
+import asyncio
 from typing import AsyncGenerator, List, Optional
 import logging  # Added for logging
 from huggingface_hub import hf_hub_download
 from datetime import datetime, timedelta
 import os
 import time
+from contextlib import aclosing
 from dotenv import load_dotenv
-from llama_cpp import Llama
 from redis.asyncio import Redis
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, func
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, ForeignKey, DateTime, Text, UniqueConstraint, func, text
 from sqlalchemy.dialects.postgresql import VECTOR
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
@@ -35,6 +34,15 @@ from passlib.context import CryptContext
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from retrieval import RETRIEVAL_BACKEND, RetrieverHolder
+from pgvector_index import KB_VECTOR_STORAGE, ensure_vector_index, search_params, search_settings_sql, search_sql
+from embedding_models import (ACTIVE_EMBEDDING_SQL, DEFAULT_COLUMN, EMBED_MODEL_NAME, READY_MODELS_SQL, ActiveEmbedding,
+                              EmbedderHolder, bootstrap_registry, check_dimension, embedding_from_row, model_dimension)
+from kb_sync import KnowledgeBaseSync, ensure_change_feed
+from embed_batcher import EmbedBatcher
+from embedding_cache import EmbeddingCache
+from llm_pool import LLM_POOL_PRELOAD, LlamaPool
+from llm_scheduler import GenerationScheduler
 
 # Load environment variables
 load_dotenv()
@@ -141,37 +149,157 @@ class ChatMessage(Base):
     message_type = Column(String, default='user')
     created_at = Column(DateTime, default=func.now())
 
+class KnowledgeDocument(Base):
+    # Long documents ingested by ingest_documents.py; their chunks are knowledge_base rows
+    __tablename__ = "kb_documents"
+    __table_args__ = (UniqueConstraint("source", "uri"),)
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)
+    uri = Column(String, nullable=False)
+    title = Column(String)
+    language = Column(String)
+    category = Column(String)
+    content_hash = Column(String(64))
+    chunk_count = Column(Integer)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now())
+
 class KnowledgeBase(Base):
     __tablename__ = "knowledge_base"
     id = Column(Integer, primary_key=True, index=True)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
-    language = Column(String, default='en')
-    embedding = Column(VECTOR(768))  # Adjust dimension based on embed_model
+    language = Column(String, default='en', index=True)
+    category = Column(String, index=True)  # same values as CommunityQuestion.category, used to partition retrieval
+    # Vectors of the model first deployed; later models go to shadow columns (reembed.py, embedding_models.py)
+    embedding = Column(VECTOR(model_dimension(EMBED_MODEL_NAME)))
     source = Column(String)  # e.g., 'kaggle_farming_faq'
+    # Upsert identity and content fingerprint maintained by ingest.py (indexes are created there)
+    source_key = Column(String(64))
+    content_hash = Column(String(64))
+    # Set on document chunks: question is the heading path, answer the chunk text
+    document_id = Column(Integer, ForeignKey("kb_documents.id", ondelete="CASCADE"))
+    chunk_index = Column(Integer)
     created_at = Column(DateTime, default=func.now())
 
-# Create tables and install pgvector
-async def init_database():
+# create_all doesn't alter existing tables; columns added after the first deploy are applied here
+SCHEMA_UPGRADES = [
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS category VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_base_language ON knowledge_base (language)",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_base_category ON knowledge_base (category)",
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS source_key VARCHAR(64)",
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)",
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS document_id INTEGER REFERENCES kb_documents (id) ON DELETE CASCADE",
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS chunk_index INTEGER",
+    "CREATE INDEX IF NOT EXISTS ix_knowledge_base_document_chunk ON knowledge_base (document_id, chunk_index)",
+]
+
+# Create tables, install pgvector and build the ANN index on the serving embedding column
+async def init_database() -> ActiveEmbedding:
     async with engine.begin() as conn:
+        # Install pgvector if not installed (before create_all, which needs the vector type)
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector;"))
         await conn.run_sync(Base.metadata.create_all)
-        # Install pgvector if not installed
-        await conn.execute("CREATE EXTENSION IF NOT EXISTS vector;")
+        for stmt in SCHEMA_UPGRADES:
+            await conn.execute(text(stmt))
+        # Which column/model serves; fails here if the column and EMBED_MODEL disagree
+        active = await conn.run_sync(bootstrap_registry)
+        await ensure_vector_index(conn, dimension=active.dimension, column=active.column)
+        await ensure_change_feed(conn)
+    return active
 
 # Call on startup
 @app.on_event("startup")
 async def startup():
-    await init_database()
+    active = await init_database()
+    if RETRIEVAL_BACKEND == "pgvector":
+        # In-process backends embed with their snapshot's model instead (check_retriever_dimension)
+        await run_in_threadpool(embedders.activate, active)
+        if EMBED_MODEL_POLL_SECONDS > 0:
+            asyncio.create_task(watch_embedding_model())
+    if SNAPSHOT_POLL_SECONDS > 0:
+        asyncio.create_task(watch_snapshots())
+    if LLM_POOL_PRELOAD:
+        if LLM_ENGINE == "continuous":
+            llm_scheduler.start()
+        else:
+            await llm_pool.warm()
+    if RETRIEVAL_BACKEND == "faiss_incremental":
+        # Apply knowledge_base inserts/updates/deletes to the in-process index as they happen
+        asyncio.create_task(KnowledgeBaseSync(SessionLocal, retrievers).run())
 
 # Global loads
 ARTIFACTS_DIR = Path("artifacts")
+EMBED_MODEL_POLL_SECONDS = float(os.getenv("EMBED_MODEL_POLL_SECONDS", "10"))
 try:
-    # Use multilingual embedding model
-    embed_model = SentenceTransformer("sentence-transformers/distiluse-base-multilingual-cased-v1")
+    # Multilingual query embedder; startup switches it to the model knowledge_base serves if that differs
+    embedders = EmbedderHolder(ActiveEmbedding(DEFAULT_COLUMN, EMBED_MODEL_NAME, model_dimension(EMBED_MODEL_NAME)))
 except Exception as e:
     logger.error(f"Failed to load embed model: {str(e)}")
     raise RuntimeError("Embed model loading failed.")
 
+# Concurrent queries share batched forward passes (EMBED_BATCH_MAX_SIZE / EMBED_BATCH_MAX_WAIT_MS);
+# repeated questions skip the encoder via the local LRU / Redis vector cache
+embed_batcher = EmbedBatcher()
+embedding_cache = EmbeddingCache(redis)
+
+def check_retriever_dimension(retriever):
+    # In-process indexes are queried with the model they were built with; load it before the swap
+    model_name = getattr(retriever, "model_name", None) or EMBED_MODEL_NAME
+    embedders.model(model_name)
+    # An empty knowledge base has no dimension yet, so only check a populated index
+    if retriever.dimension:
+        check_dimension(model_name, retriever.dimension, f"{RETRIEVAL_BACKEND} index")
+
+async def query_embedder():
+    # (retriever, column, model name, model) used together for one query, so the query vector always
+    # comes from the model of the index it searches: a snapshot's own model, or the serving pgvector column's
+    retriever = retrievers.current
+    if retriever is None:
+        active, model = embedders.current
+        return None, active.column, active.model, model
+    model_name = getattr(retriever, "model_name", None) or EMBED_MODEL_NAME
+    # Loaded when the retriever was validated; embedders.model() holds its lock for a whole load,
+    # so a model evicted since is loaded in the threadpool instead of blocking the event loop
+    model = embedders.cached(model_name)
+    if model is None:
+        model = await run_in_threadpool(embedders.model, model_name)
+    return retriever, None, model_name, model
+
+# In-process retriever (holder.current is None when retrieval goes through pgvector).
+# Snapshots published under artifacts/ are swapped in without a restart.
+SNAPSHOT_POLL_SECONDS = float(os.getenv("SNAPSHOT_POLL_SECONDS", "10"))
+try:
+    retrievers = RetrieverHolder(RETRIEVAL_BACKEND, ARTIFACTS_DIR, validate=check_retriever_dimension)
+except Exception as e:
+    logger.error(f"Failed to load {RETRIEVAL_BACKEND} retriever: {str(e)}")
+    raise RuntimeError("Retriever loading failed.")
+logger.info(f"Retrieval backend: {RETRIEVAL_BACKEND} (snapshot {retrievers.version or 'none'})")
+
+async def watch_snapshots():
+    # Each worker polls artifacts/CURRENT and swaps its own retriever when a new snapshot is published
+    while True:
+        await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+        try:
+            await run_in_threadpool(retrievers.reload_if_changed)
+        except Exception as e:
+            logger.error(f"Snapshot reload failed, keeping {retrievers.version}: {str(e)}")
+
+async def watch_embedding_model():
+    # Follows reembed.py: a 'ready' model is preloaded, the cutover then swaps column and model together
+    while True:
+        await asyncio.sleep(EMBED_MODEL_POLL_SECONDS)
+        try:
+            async with SessionLocal() as db:
+                active = embedding_from_row((await db.execute(text(ACTIVE_EMBEDDING_SQL))).fetchone())
+                ready = [r[0] for r in (await db.execute(text(READY_MODELS_SQL))).fetchall()]
+            for model_name in ready:
+                await run_in_threadpool(embedders.model, model_name)
+            if active is not None:
+                await run_in_threadpool(embedders.activate, active)
+        except Exception as e:
+            logger.error(f"Embedding model switch failed, keeping {embedders.current[0].model}: {str(e)}")
+
 # Model setup
 model_repo = "QuantFactory/Phi-3-mini-4k-instruct-GGUF"
 model_filename = "Phi-3-mini-4k-instruct.Q4_0.gguf"
@@ -243,49 +371,139 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         raise credentials_exception
     return username
 
+# Usernames allowed to call /admin endpoints
+ADMIN_USERS = {u.strip() for u in os.getenv("ADMIN_USERS", "").split(",") if u.strip()}
+
+async def get_admin_user(current_user: str = Depends(get_current_user)):
+    if current_user not in ADMIN_USERS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 class RegisterUser(BaseModel):
     username: str
     password: str
     email: str
 
 # Pydantic models (keep same as before for others)
+class Query(BaseModel):
+    text: str
+    lang: Optional[str] = None
+    translate_to: Optional[str] = None
+    # Restrict retrieval to this category (e.g. "irrigation"); the language partition follows lang
+    category: Optional[str] = None
+    # pgvector ANN recall knobs (None = server defaults from pgvector_index)
+    ef_search: Optional[int] = Field(None, ge=1, le=1000)
+    probes: Optional[int] = Field(None, ge=1, le=1000)
+
+# Generation engine: "continuous" batches the decode steps of all in-flight requests in one
+# llama.cpp context (llm_scheduler.py); "pool" runs each request on its own context (llm_pool.py).
+# Both load on first use.
+LLM_ENGINE = os.getenv("LLM_ENGINE", "continuous").lower()
+LLM_MAX_TOKENS = int(os.getenv("LLM_MAX_TOKENS", "512"))
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.2"))
+SYSTEM_PROMPT = (
+    "You are an agricultural assistant for farmers. Answer the question using the context below. "
+    "If the context does not cover it, say so briefly and give general guidance."
+)
+# Phi-3 instruct chat format. Everything up to the retrieved contexts is the same for every request,
+# so both engines evaluate it once and reuse its KV cache
+PROMPT_PREFIX = f"<|system|>\n{SYSTEM_PROMPT}<|end|>\n<|user|>\nContext:\n"
+
+def build_prompt(question: str, contexts: List[str]) -> str:
+    context = "\n".join(contexts)
+    return f"{PROMPT_PREFIX}{context}\nQuestion: {question}<|end|>\n<|assistant|>\n"
+
+llm_pool = LlamaPool(model_path, prefix=PROMPT_PREFIX)
+llm_scheduler = GenerationScheduler(model_path, prefix=PROMPT_PREFIX)
 
-# Lazy-loaded LLM
-llm_model = None
-llm_lock = threading.Lock()
+LLM_STOP = ["<|end|>", "<|user|>"]
+
+def stream_answer(prompt: str) -> AsyncGenerator[str, None]:
+    # Text deltas of the answer as llama.cpp samples them
+    if LLM_ENGINE == "continuous":
+        return llm_scheduler.stream(prompt, LLM_MAX_TOKENS, LLM_TEMPERATURE, LLM_STOP)
+    # Queues in the pool while all contexts are busy
+    return llm_pool.stream(prompt, max_tokens=LLM_MAX_TOKENS, temperature=LLM_TEMPERATURE, stop=LLM_STOP)
 
 async def get_db():
     async with SessionLocal() as session:
         yield session
 
 # Replace FAISS with pgvector in retrieval
-async def retrieve_from_pgvector(emb: np.ndarray, top_k: int = 3, db: AsyncSession = Depends(get_db)):
-    # Query using cosine similarity (assuming L2 normalized)
-    query_emb = emb.tolist()[0]
+async def retrieve_from_pgvector(emb: np.ndarray, top_k: int = 3, db: AsyncSession = Depends(get_db),
+                                 ef_search: Optional[int] = None, probes: Optional[int] = None,
+                                 language: Optional[str] = None, category: Optional[str] = None,
+                                 column: str = DEFAULT_COLUMN):
+    # Query using cosine similarity (assuming L2 normalized); with KB_VECTOR_STORAGE=halfvec/binary
+    # the quantized index yields a shortlist that is re-ranked on the full-precision column
+    params = search_params(emb[0], top_k, KB_VECTOR_STORAGE, category=category)
+    # Per-request HNSW/IVFFlat recall settings, scoped to this transaction
+    for stmt in search_settings_sql(ef_search, probes, params.get("candidates", 0), filtered=bool(language or category)):
+        await db.execute(text(stmt))
     results = await db.execute(
-        "SELECT id, question, answer FROM knowledge_base ORDER BY embedding <=> :emb LIMIT :top_k",
-        {"emb": query_emb, "top_k": top_k}
+        text(search_sql(KB_VECTOR_STORAGE, emb.shape[1], language=language, category=category, column=column)),
+        params
     )
     return results.fetchall()
 
+async def retrieve(emb: np.ndarray, top_k: int = 3, ef_search: Optional[int] = None, probes: Optional[int] = None,
+                   language: Optional[str] = None, category: Optional[str] = None,
+                   retriever=None, column: str = DEFAULT_COLUMN):
+    # Dispatch to the backend from query_embedder() (retriever None = pgvector on column); rows
+    # expose (id, question, answer, ...) either way. The caller holds one reference, so a
+    # concurrent snapshot swap can't change the index mid-search.
+    language = language if language in SUPPORTED_LANGS else None
+    if retriever is None:
+        async with SessionLocal() as db:
+            results = await retrieve_from_pgvector(emb, top_k, db, ef_search=ef_search, probes=probes,
+                                                   language=language, category=category, column=column)
+    else:
+        results = (await run_in_threadpool(retriever.search, emb, top_k, {"language": language, "category": category}))[0]
+    if not results and (language or category):
+        # Nothing in the partition (e.g. no Telugu entries yet): fall back to the whole corpus
+        return await retrieve(emb, top_k, ef_search=ef_search, probes=probes, retriever=retriever, column=column)
+    return results
+
+# Answers streamed to the end vs. abandoned by the client mid-generation
+query_stats = {"completed": 0, "aborted": 0}
+
 # stream_query with caching and pgvector
-async def stream_query(q: Query, top_k: int = 3):
-    cache_key = f"query:{q.text}:{q.lang}:{q.translate_to}"
+async def stream_query(q: Query, top_k: int = 3, request: Optional[Request] = None):
+    # Retrieval and the prompt work in English: detect the query language (q.lang wins) and translate.
+    # The embedder is multilingual, so a failed translation falls back to the original text.
+    # search_lang selects the language partition; the "en" fallback of a failed detection doesn't.
+    source_lang = search_lang = q.lang
+    if not source_lang:
+        try:
+            source_lang = search_lang = detect(q.text)
+        except LangDetectException:
+            source_lang = "en"
+
+    # Snapshot version in the key so a KB update doesn't serve answers retrieved from the old index
+    cache_key = f"query:{retrievers.version}:{q.text}:{search_lang}:{q.category}:{q.translate_to}"
     cached = await redis.get(cache_key)
     if cached:
         yield json.dumps(json.loads(cached)) + "\n"
         return
 
-    # ... (language detection and translation logic same)
+    english_query = q.text
+    if source_lang != "en" and source_lang in SUPPORTED_LANGS:
+        try:
+            translator = await run_in_threadpool(get_translator, source_lang, "en")
+            english_query = (await run_in_threadpool(translator, q.text))[0]["translation_text"]
+        except Exception as e:
+            logger.warning(f"Query translation {source_lang}->en failed, using the original text: {str(e)}")
 
-    # Embed
-    emb = await run_in_threadpool(
-        embed_model.encode, [english_query], convert_to_numpy=True
-    )
+    # Embed with the model of the index searched below
+    retriever, column, embed_model_name, embed_model = await query_embedder()
+    emb = (await embedding_cache.get_or_encode(
+        embed_model_name, english_query, lambda value: embed_batcher.encode(embed_model, value)
+    ))[None, :]
 
-    # Retrieve from pgvector
+    # Retrieve from the configured backend (pgvector or in-process index)
     try:
-        results = await retrieve_from_pgvector(emb, top_k)
+        results = await retrieve(emb, top_k, ef_search=q.ef_search, probes=q.probes, language=search_lang,
+                                 category=q.category, retriever=retriever, column=column)
         contexts = []
         for res in results:
             context = f"Q: {res[1]}\nA: {res[2]}\n"
@@ -296,16 +514,58 @@ async def stream_query(q: Query, top_k: int = 3):
         yield json.dumps({"error": "Retrieval failed", "status": "error"}) + "\n"
         return
 
-    # ... (generation logic same)
+    # Stream the answer as it is generated; the first chunk arrives after prefill, not after the whole answer
+    yield json.dumps({"status": "Generating answer..."}) + "\n"
+    parts = []
+    started = time.perf_counter()
+    aborted = False
+    try:
+        # Closing the delta stream (on disconnect, cancellation or error) stops generation and frees
+        # the scheduler sequence / pool context right away
+        async with aclosing(stream_answer(build_prompt(english_query, contexts))) as deltas:
+            async for delta in deltas:
+                if request is not None and await request.is_disconnected():
+                    aborted = True
+                    break
+                if not parts:
+                    # The model opens its turn with whitespace
+                    delta = delta.lstrip()
+                    if not delta:
+                        continue
+                parts.append(delta)
+                yield json.dumps({"generated_answer_chunk": delta}) + "\n"
+    except (asyncio.CancelledError, GeneratorExit):
+        # Starlette cancels the response (or closes this generator) when the client goes away
+        aborted = True
+        raise
+    except Exception as e:
+        logger.error(f"Generation error: {str(e)}")
+        yield json.dumps({"error": "Generation failed", "status": "error"}) + "\n"
+        return
+    finally:
+        if aborted:
+            query_stats["aborted"] += 1
+            logger.info(f"Client disconnected after {len(parts)} answer chunks "
+                        f"({time.perf_counter() - started:.1f}s); generation cancelled")
+    if aborted:
+        return
+    query_stats["completed"] += 1
+    llm_response = "".join(parts).strip()
 
-    # Cache final
+    # Cache final: the full answer, so a cache hit replays it as one message
     final_response = {
         "generated_answer": llm_response,
+        "contexts": contexts,
         "status": "complete"
     }
     await redis.set(cache_key, json.dumps(final_response), ex=3600)
     yield json.dumps(final_response) + "\n"
 
+# NDJSON stream: status lines, generated_answer_chunk deltas, then the complete answer
+@app.post("/query")
+async def query(q: Query, request: Request):
+    return StreamingResponse(stream_query(q, request=request), media_type="application/x-ndjson")
+
 # Community endpoints with auth and rate limit
 @app.post("/community/questions")
 @limiter.limit("5/minute")
@@ -340,25 +600,39 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSessi
     access_token = jwt.encode({"sub": form_data.username, "exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)}, SECRET_KEY, algorithm=ALGORITHM)
     return {"access_token": access_token, "token_type": "bearer"}
 
+# Swap the retrieval index to the published (or a given) snapshot while requests keep flowing
+@app.post("/admin/reload-index")
+async def reload_index(version: Optional[str] = None, admin: str = Depends(get_admin_user)):
+    previous = retrievers.version
+    try:
+        active = await run_in_threadpool(retrievers.reload, version)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Index reload failed: {str(e)}")
+        raise HTTPException(status_code=500, detail="Index reload failed")
+    return {"status": "success", "backend": RETRIEVAL_BACKEND, "previous_version": previous, "version": active}
+
+# Query embedding cache hit/miss counters for this worker
+@app.get("/admin/embedding-cache")
+async def embedding_cache_stats(admin: str = Depends(get_admin_user)):
+    return {"status": "success", **embedding_cache.stats()}
+
+# LLM context pool occupancy and queue waits for this worker
+@app.get("/admin/llm-pool")
+async def llm_pool_stats(admin: str = Depends(get_admin_user)):
+    return {"status": "success", **llm_pool.stats(), "queries": query_stats}
+
+# Continuous-batching throughput, occupancy and time to first token for this worker
+@app.get("/admin/llm-scheduler")
+async def llm_scheduler_stats(admin: str = Depends(get_admin_user)):
+    return {"status": "success", **llm_scheduler.stats(), "queries": query_stats}
+
 # ... (keep other endpoints, adapt to async db)
 
-# Script for populating knowledge base (run separately)
-# Example script to load dataset and insert
-# Assuming CSV from Kaggle Farming FAQ
-import pandas as pd
-from sqlalchemy import create_engine
-
-def populate_knowledge_base():
-    df = pd.read_csv("farming_faq_dataset.csv")  # Download from Kaggle
-    engine = create_engine(DATABASE_URL.replace("+asyncpg", ""))
-    with engine.connect() as conn:
-        for _, row in df.iterrows():
-            emb = embed_model.encode(row['question'])
-            conn.execute(
-                "INSERT INTO knowledge_base (question, answer, embedding, source) VALUES (%s, %s, %s, %s)",
-                (row['question'], row['answer'], emb.tolist(), 'kaggle_farming_faq')
-            )
-    # Similarly for other datasets like Agronomic QA
+# Populating the knowledge base (run separately): streaming bulk loader in ingest.py
+#   python ingest.py farming_faq_dataset.csv --source kaggle_farming_faq  # Download from Kaggle
+# Similarly for other datasets like Agronomic QA
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8005)
\ No newline at end of file
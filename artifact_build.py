@@ -0,0 +1,275 @@
+# artifact_build.py
+# Resumable, chunked builds of retrieval snapshots (driven by setup_artifacts.py)
+#
+#   artifacts/builds/<build_id>/
+#     build.json                  input, model and index settings (a resume must match them)
+#     chunks/000042/              rows.jsonl + embeddings.npy for input chunk 42
+#     chunks/COUNT                number of input chunks, written once the input was read to the end
+#     index/trained.faiss         trained but empty IVF index (flat indexes skip training)
+#     index/partial.faiss         index holding the first chunks, as many as its vector count covers
+#     index/progress.json         factory string of the index (and chunks added, for humans)
+#
+# Every checkpoint is written under a temporary name and renamed, so a crash leaves either
+# the previous or the next state, never a torn file. Re-running the same command resumes:
+# finished chunks are skipped and the index continues from its last checkpoint.
+#
+# --shard k/N embeds only chunks i with i % N == k, so N processes (or machines sharing
+# artifacts/) embed in parallel; whichever finds all chunks present assembles the snapshot.
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from index_build import FAISS_INDEX_TYPE, TRAIN_SAMPLE, build_report, format_report, new_faiss_index, train_faiss_index
+from kb_store import HASH_COLUMN, StoreWriter
+from retrieval import normalize_rows
+from snapshots import new_snapshot_dir, prune_snapshots, publish_snapshot
+
+logger = logging.getLogger(__name__)
+
+BUILDS_DIRNAME = "builds"
+BUILD_CHUNK_ROWS = int(os.getenv("BUILD_CHUNK_ROWS", "50000"))
+# Index checkpoint after every this many chunks added
+BUILD_CHECKPOINT_CHUNKS = int(os.getenv("BUILD_CHECKPOINT_CHUNKS", "10"))
+
+# Row fields kept per chunk and the store column each one becomes
+ROW_COLUMNS = {"question": "questions", "answer": "answers", "language": "languages",
+               "category": "categories", "content_hash": HASH_COLUMN}
+
+
+def _write_json_atomic(path: Path, data: dict):
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _write_index_atomic(index, path: Path):
+    tmp = path.with_name(f".{path.name}.tmp")
+    faiss.write_index(index, str(tmp))
+    os.replace(tmp, path)
+
+
+def build_id_for(settings: dict) -> str:
+    # Same input and settings -> same build directory, so re-running a command resumes it
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+
+
+class ArtifactBuild:
+    """One checkpointed build under artifacts/builds/<build_id>/."""
+
+    def __init__(self, artifacts_dir: Path, settings: dict, build_id: Optional[str] = None):
+        self.artifacts_dir = Path(artifacts_dir)
+        self.settings = settings
+        self.build_id = build_id or build_id_for(settings)
+        self.dir = self.artifacts_dir / BUILDS_DIRNAME / self.build_id
+        self.chunks_dir = self.dir / "chunks"
+        self.index_dir = self.dir / "index"
+        self.chunks_dir.mkdir(parents=True, exist_ok=True)
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+
+        manifest = self.dir / "build.json"
+        if manifest.exists():
+            with open(manifest) as f:
+                stored = json.load(f)
+            if stored != settings:
+                raise RuntimeError(f"Build {self.build_id} was started with different settings: {stored}")
+            logger.info(f"Resuming build {self.build_id}")
+        else:
+            _write_json_atomic(manifest, settings)
+
+    # -- embedding ---------------------------------------------------------
+
+    def chunk_dir(self, i: int) -> Path:
+        return self.chunks_dir / f"{i:06d}"
+
+    def chunk_done(self, i: int) -> bool:
+        return (self.chunk_dir(i) / "embeddings.npy").exists()
+
+    def total_chunks(self) -> Optional[int]:
+        try:
+            return int((self.chunks_dir / "COUNT").read_text())
+        except FileNotFoundError:
+            return None
+
+    def complete(self) -> bool:
+        total = self.total_chunks()
+        return total is not None and all(self.chunk_done(i) for i in range(total))
+
+    def _write_chunk(self, i: int, rows: List[Dict], embeddings: np.ndarray):
+        # Whole chunk directory renamed into place; another shard finishing first is fine
+        tmp = self.chunks_dir / f".{i:06d}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        with open(tmp / "rows.jsonl", "w", encoding="utf-8") as f:
+            for row in rows:
+                f.write(json.dumps({k: row.get(k) for k in ROW_COLUMNS}, ensure_ascii=False) + "\n")
+        np.save(tmp / "embeddings.npy", embeddings.astype(np.float32))
+        try:
+            os.replace(tmp, self.chunk_dir(i))
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def embed(self, row_chunks: Iterable[List[Dict]], embedder_factory: Callable, shard: int = 0,
+              num_shards: int = 1, reuse: Optional[Dict[str, np.ndarray]] = None) -> int:
+        # Embeds this shard's unfinished chunks; vectors of unchanged rows come from reuse (content hash -> vector)
+        embedder = None
+        encoded = 0
+        count = 0
+        started = time.perf_counter()
+        try:
+            for i, rows in enumerate(row_chunks):
+                count = i + 1
+                if i % num_shards != shard or self.chunk_done(i):
+                    continue
+                vectors = [reuse.get(r["content_hash"]) if reuse else None for r in rows]
+                missing = [j for j, v in enumerate(vectors) if v is None]
+                if missing:
+                    if embedder is None:
+                        embedder = embedder_factory()
+                    for j, vector in zip(missing, embedder.encode([rows[j]["question"] for j in missing])):
+                        vectors[j] = vector
+                    encoded += len(missing)
+                dimension = len(vectors[0]) if vectors else 0
+                embeddings = np.stack(vectors).astype(np.float32) if vectors else np.zeros((0, dimension), np.float32)
+                self._write_chunk(i, rows, embeddings)
+                logger.info(f"Chunk {i}: {len(rows)} rows, {len(missing)} encoded "
+                            f"({encoded / max(time.perf_counter() - started, 1e-9):.0f} rows/s)")
+        finally:
+            if embedder is not None:
+                embedder.close()
+        # Reading the input to the end is what tells us how many chunks there are
+        (self.chunks_dir / "COUNT").write_text(str(count))
+        return encoded
+
+    def iter_chunks(self) -> Iterator[Tuple[List[Dict], np.ndarray]]:
+        for i in range(self.total_chunks() or 0):
+            with open(self.chunk_dir(i) / "rows.jsonl", encoding="utf-8") as f:
+                rows = [json.loads(line) for line in f]
+            yield rows, np.load(self.chunk_dir(i) / "embeddings.npy", mmap_mode="r")
+
+    # -- assembly ----------------------------------------------------------
+
+    def _chunk_sizes(self) -> Tuple[List[int], int]:
+        sizes, dimension = [], 0
+        for i in range(self.total_chunks() or 0):
+            embeddings = np.load(self.chunk_dir(i) / "embeddings.npy", mmap_mode="r")
+            sizes.append(len(embeddings))
+            if len(embeddings):
+                dimension = embeddings.shape[1]
+        return sizes, dimension
+
+    def _training_sample(self, sizes: List[int]) -> np.ndarray:
+        # Uniform sample of up to TRAIN_SAMPLE rows across all chunks, one chunk in memory at a time
+        total = sum(sizes)
+        rng = np.random.default_rng(0)
+        picks = np.sort(rng.choice(total, min(total, TRAIN_SAMPLE), replace=False))
+        sample, start = [], 0
+        for i, size in enumerate(sizes):
+            local = picks[(picks >= start) & (picks < start + size)] - start
+            if len(local):
+                sample.append(normalize_rows(np.load(self.chunk_dir(i) / "embeddings.npy", mmap_mode="r")[local]))
+            start += size
+        return np.vstack(sample)
+
+    def build_index(self, index_type: str = FAISS_INDEX_TYPE, checkpoint_every: int = BUILD_CHECKPOINT_CHUNKS):
+        sizes, dimension = self._chunk_sizes()
+        progress_path = self.index_dir / "progress.json"
+        partial_path = self.index_dir / "partial.faiss"
+        trained_path = self.index_dir / "trained.faiss"
+
+        index = None
+        if progress_path.exists() and partial_path.exists():
+            with open(progress_path) as f:
+                factory = json.load(f)["factory"]
+            index = faiss.read_index(str(partial_path))
+            # The chunks in the checkpoint follow from its vector count, not from progress.json: the
+            # two files are renamed separately, and a crash in between must not add chunks twice
+            offsets = np.cumsum([0] + sizes)
+            matches = np.flatnonzero(offsets == index.ntotal)
+            if len(matches):
+                start = int(matches[-1])
+                logger.info(f"Resuming {factory} index at chunk {start}/{len(sizes)} ({index.ntotal} vectors)")
+            else:
+                logger.warning(f"Index checkpoint holds {index.ntotal} vectors, which is no chunk boundary; "
+                               f"rebuilding it")
+                index = None
+        if index is None:
+            index, factory = new_faiss_index(sum(sizes), dimension, index_type)
+            if not index.is_trained:
+                if trained_path.exists():
+                    index = faiss.read_index(str(trained_path))
+                else:
+                    train_faiss_index(index, self._training_sample(sizes))
+                    _write_index_atomic(index, trained_path)
+            start = 0
+            _write_json_atomic(progress_path, {"factory": factory, "chunks_added": 0})
+
+        for i in range(start, len(sizes)):
+            if sizes[i]:
+                index.add(normalize_rows(np.load(self.chunk_dir(i) / "embeddings.npy", mmap_mode="r")))
+            if (i + 1) % checkpoint_every == 0 or i + 1 == len(sizes):
+                _write_index_atomic(index, partial_path)
+                # Informational only; a resume goes by index.ntotal
+                _write_json_atomic(progress_path, {"factory": factory, "chunks_added": i + 1})
+                logger.info(f"Index checkpoint: {i + 1}/{len(sizes)} chunks, {index.ntotal} vectors")
+        return index, factory
+
+    def assemble(self, model: str, index_type: str = FAISS_INDEX_TYPE, report: bool = True,
+                 keep_build: bool = False) -> Optional[str]:
+        # Returns the published version, or None when another shard is already assembling.
+        # flock is released by the kernel if the holder dies, so a crashed assembly can be resumed.
+        with open(self.dir / "assemble.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            if not (self.dir / "build.json").exists():
+                # The other shard already published and removed the build
+                return None
+            return self._assemble(model, index_type, report, keep_build)
+
+    def _assemble(self, model: str, index_type: str, report: bool, keep_build: bool) -> str:
+        if not self.complete():
+            done = len([p for p in self.chunks_dir.iterdir() if p.is_dir() and not p.name.startswith(".")])
+            raise RuntimeError(f"Build {self.build_id} is incomplete ({done} of {self.total_chunks() or '?'} chunks embedded)")
+        index, factory = self.build_index(index_type)
+        sizes, dimension = self._chunk_sizes()
+
+        snapshot_dir = new_snapshot_dir(self.artifacts_dir)
+        # Columnar store streamed chunk by chunk; ids are input positions
+        writer = StoreWriter(snapshot_dir / "qa_store", sum(sizes), dimension, list(ROW_COLUMNS.values()), model=model)
+        position = 0
+        for rows, embeddings in self.iter_chunks():
+            columns = {column: [r.get(field) or "" for r in rows] for field, column in ROW_COLUMNS.items()}
+            writer.append(range(position, position + len(rows)), embeddings, columns)
+            position += len(rows)
+        store_dir = writer.close()
+
+        # No qa_meta.pkl: its readers need every question and answer unpickled, which is what
+        # qa_store replaces; FaissRetriever reads the store (model and ids included) instead
+        faiss.write_index(index, str(snapshot_dir / "qa_index.faiss"))
+        if report and position:
+            # Memory-mapped: the report reads the sampled queries and one block of rows at a time
+            embeddings = np.load(store_dir / "embeddings.npy", mmap_mode="r")
+            result = build_report(index, factory, embeddings)
+            with open(snapshot_dir / "index_report.json", "w") as f:
+                json.dump(result, f, indent=2)
+            print(format_report(result))
+
+        # Flip artifacts/CURRENT atomically, then drop old snapshots and the build's checkpoints
+        version = publish_snapshot(self.artifacts_dir, snapshot_dir)
+        prune_snapshots(self.artifacts_dir)
+        if not keep_build:
+            shutil.rmtree(self.dir, ignore_errors=True)
+        return version
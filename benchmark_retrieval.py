@@ -0,0 +1,282 @@
+# benchmark_retrieval.py
+# Recall / latency / throughput / memory benchmark for the retrieval backends
+#
+# Every backend is built from the same corpus and searched with the same query set; ground
+# truth is brute-force float32 inner product over the full corpus.
+#
+# Usage (offline, no database needed):
+#   python benchmark_retrieval.py --synthetic 200000 --dim 512
+#   python benchmark_retrieval.py --store artifacts/qa_store --queries queries.txt
+#   python benchmark_retrieval.py --store artifacts/qa_store --backends numpy,faiss_flat,faiss_ivfpq --concurrency 1,8,32
+# pgvector backends query the live knowledge_base and need --from-database:
+#   python benchmark_retrieval.py --from-database --backends numpy,pgvector_exact,pgvector_hnsw
+import argparse
+import json
+import logging
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from embedding_models import DEFAULT_COLUMN, EMBED_MODEL_NAME, load_model
+from kb_store import KBStore, read_active_embedding, read_knowledge_base, write_store
+from retrieval import DATABASE_URL, FAISS_RERANK_FACTOR, FaissRetriever, IncrementalFaissRetriever, NumpyRetriever, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("numpy", "numpy_f16", "faiss_flat", "faiss_ivfpq", "faiss_opq_ivfpq", "faiss_incremental",
+            "pgvector_exact", "pgvector_hnsw")
+DEFAULT_BACKENDS = "numpy,numpy_f16,faiss_flat,faiss_ivfpq,faiss_opq_ivfpq"
+
+
+def rss_bytes() -> int:
+    # Current resident set size (Linux /proc), falling back to the peak from getrusage
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def synthetic_corpus(n: int, dimension: int, clusters: int = 256, seed: int = 0) -> np.ndarray:
+    # Gaussian clusters rather than uniform noise, so ANN indexes see realistic structure
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, n)
+    matrix = centers[assignment] + 0.35 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return normalize_rows(matrix)
+
+
+def serving_embedding(args) -> Tuple[str, str]:
+    # (model, knowledge_base column) the corpus was embedded with: the registry's active row for
+    # the live table (after a reembed.py cutover that's no longer EMBED_MODEL / embedding), the
+    # store's recorded model for a store
+    if args.from_database:
+        active = read_active_embedding(DATABASE_URL)
+        if active is not None:
+            return active.model, active.column
+    elif args.store:
+        store = KBStore(args.store)
+        model = store.model_name
+        store.close()
+        if model:
+            return model, DEFAULT_COLUMN
+    return EMBED_MODEL_NAME, DEFAULT_COLUMN
+
+
+def load_corpus(args, column: str = DEFAULT_COLUMN):
+    # Returns (ids, questions, answers, normalized float32 embeddings)
+    if args.store:
+        store = KBStore(args.store)
+        return (np.asarray(store.ids), list(store.questions), list(store.answers),
+                normalize_rows(np.asarray(store.embeddings, dtype=np.float32)))
+    if args.from_database:
+        ids, columns, embeddings = read_knowledge_base(DATABASE_URL, column)
+        return np.asarray(ids), columns["questions"], columns["answers"], normalize_rows(embeddings)
+    embeddings = synthetic_corpus(args.synthetic, args.dim)
+    n = len(embeddings)
+    return np.arange(n, dtype=np.int64), [f"q{i}" for i in range(n)], [""] * n, embeddings
+
+
+def load_queries(args, embeddings: np.ndarray, model_name: str = EMBED_MODEL_NAME) -> np.ndarray:
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+        model = load_model(model_name)
+        return normalize_rows(model.encode(texts, batch_size=64, convert_to_numpy=True))
+    # Perturbed corpus rows stand in for unseen questions near existing entries
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(embeddings), min(args.n_queries, len(embeddings)), replace=False)
+    noise = 0.1 * rng.standard_normal((len(picks), embeddings.shape[1])).astype(np.float32)
+    return normalize_rows(embeddings[picks] + noise)
+
+
+def ground_truth(embeddings: np.ndarray, queries: np.ndarray, ids: np.ndarray, k: int) -> np.ndarray:
+    exact = NumpyRetriever(embeddings, ids, [""] * len(ids), [""] * len(ids))
+    _, idx = exact.search_indices(queries, k)
+    return ids[idx]
+
+
+class Workspace:
+    """Temporary snapshot-like directory so FAISS backends load exactly as the app does."""
+
+    def __init__(self, ids, questions, answers, embeddings):
+        self.path = Path(tempfile.mkdtemp(prefix="retrieval-bench-"))
+        self.ids, self.embeddings = ids, embeddings
+        self.store_dir = write_store(self.path / "qa_store", ids, embeddings,
+                                     {"questions": questions, "answers": answers})
+
+    def faiss_index(self, index_type: str) -> Path:
+        import faiss
+
+        from index_build import build_faiss_index
+
+        index, factory = build_faiss_index(self.embeddings, index_type=index_type)
+        path = self.path / f"{index_type}.faiss"
+        faiss.write_index(index, str(path))
+        logger.info(f"Built {factory} for benchmarking")
+        return path
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def pgvector_search(storage_hnsw: bool, column: str = DEFAULT_COLUMN) -> Callable:
+    from sqlalchemy import create_engine, text
+
+    from pgvector_index import KB_VECTOR_STORAGE, search_params, search_settings_sql, search_sql
+
+    engine = create_engine(DATABASE_URL.replace("+asyncpg", ""), pool_size=64, max_overflow=0)
+
+    def search(q: np.ndarray, k: int) -> List[List[int]]:
+        storage = KB_VECTOR_STORAGE if storage_hnsw else "vector"
+        results = []
+        with engine.begin() as conn:
+            if not storage_hnsw:
+                # Force the sequential scan: exact distances over every row
+                conn.execute(text("SET LOCAL enable_indexscan = off"))
+            for emb in q:
+                params = search_params(emb, k, storage)
+                for stmt in search_settings_sql(candidates=params.get("candidates", 0)):
+                    conn.execute(text(stmt))
+                rows = conn.execute(text(search_sql(storage, q.shape[1], column=column)), params).fetchall()
+                results.append([r[0] for r in rows])
+        return results
+
+    return search
+
+
+def make_backend(name: str, workspace: Workspace, column: str = DEFAULT_COLUMN):
+    # Returns (search(q, k) -> kb ids per query, bytes held by the index structure)
+    if name in ("numpy", "numpy_f16"):
+        dtype = np.float16 if name == "numpy_f16" else np.float32
+        retriever = NumpyRetriever(workspace.embeddings.astype(dtype), workspace.ids,
+                                   [""] * len(workspace.ids), [""] * len(workspace.ids))
+        return (lambda q, k: [[h[0] for h in hits] for hits in retriever.search(q, k)]), retriever.matrix.nbytes
+    if name.startswith("faiss_") and name != "faiss_incremental":
+        index_path = workspace.faiss_index(name[len("faiss_"):])
+        retriever = FaissRetriever(index_path, store_dir=workspace.store_dir, mmap=False)
+        return (lambda q, k: [[h[0] for h in hits] for hits in retriever.search(q, k)]), index_path.stat().st_size
+    if name == "faiss_incremental":
+        retriever = IncrementalFaissRetriever.from_store(KBStore(workspace.store_dir))
+        return (lambda q, k: [[h[0] for h in hits] for hits in retriever.search(q, k)]), retriever.index.ntotal * retriever.dimension * 4
+    if name in ("pgvector_exact", "pgvector_hnsw"):
+        # Index size lives in Postgres; see `python pgvector_index.py status`
+        return pgvector_search(name == "pgvector_hnsw", column), 0
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    return float(np.percentile(samples, q) * 1000) if samples else 0.0
+
+
+def recall(found: List[List[int]], truth: np.ndarray, k: int) -> float:
+    hits = sum(len(set(f[:k]) & set(t[:k].tolist())) for f, t in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def qps_at(search: Callable, queries: np.ndarray, k: int, concurrency: int) -> float:
+    # One query per call, like concurrent /query requests each embedding a single question
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(lambda i: search(queries[i:i + 1], k), range(len(queries))))
+    return len(queries) / (time.perf_counter() - started)
+
+
+def benchmark_backend(name: str, workspace: Workspace, queries: np.ndarray, truth: np.ndarray, k: int,
+                      concurrency: List[int], warmup: int = 20, column: str = DEFAULT_COLUMN) -> Dict:
+    rss_before = rss_bytes()
+    started = time.perf_counter()
+    search, index_bytes = make_backend(name, workspace, column)
+    build_seconds = time.perf_counter() - started
+    rss_after = rss_bytes()
+
+    for i in range(min(warmup, len(queries))):
+        search(queries[i:i + 1], k)
+    latencies, found = [], []
+    for i in range(len(queries)):
+        t0 = time.perf_counter()
+        found.extend(search(queries[i:i + 1], k))
+        latencies.append(time.perf_counter() - t0)
+
+    return {
+        "backend": name,
+        "k": k,
+        "recall": recall(found, truth, k),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p99_ms": percentile_ms(latencies, 99),
+        "qps": {str(c): qps_at(search, queries, k, c) for c in concurrency},
+        "index_mib": index_bytes / 2**20,
+        "rss_delta_mib": max(rss_after - rss_before, 0) / 2**20,
+        "load_seconds": build_seconds,
+    }
+
+
+def format_results(results: List[Dict], concurrency: List[int]) -> str:
+    header = f"{'backend':<18} {'recall@k':>8} {'p50 ms':>8} {'p99 ms':>8} " + \
+             " ".join(f"{'qps@' + str(c):>10}" for c in concurrency) + f" {'index MiB':>10} {'rss MiB':>8}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        lines.append(
+            f"{r['backend']:<18} {r['recall']:>8.3f} {r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f} "
+            + " ".join(f"{r['qps'][str(c)]:>10.0f}" for c in concurrency)
+            + f" {r['index_mib']:>10.1f} {r['rss_delta_mib']:>8.1f}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval backends (recall@k, latency, QPS, memory)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--store", type=Path, help="KB store directory (python kb_store.py export)")
+    source.add_argument("--from-database", action="store_true", help="Read knowledge_base from DATABASE_URL")
+    source.add_argument("--synthetic", type=int, default=100_000, help="Synthetic corpus size (default source)")
+    parser.add_argument("--dim", type=int, default=512, help="Synthetic embedding dimension")
+    parser.add_argument("--queries", type=Path, help="Text file with one query per line, embedded with the serving model")
+    parser.add_argument("--n-queries", type=int, default=1000, help="Sampled queries when --queries is not given")
+    parser.add_argument("--backends", default=DEFAULT_BACKENDS, help=f"Comma-separated subset of {','.join(BACKENDS)}")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--concurrency", default="1,8,32", help="Comma-separated thread counts for the QPS runs")
+    parser.add_argument("--json", type=Path, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    unknown = set(backends) - set(BACKENDS)
+    if unknown:
+        parser.error(f"unknown backends: {', '.join(sorted(unknown))}")
+    if any(b.startswith("pgvector") for b in backends) and not args.from_database:
+        parser.error("pgvector backends search the live table; use --from-database so ground truth matches it")
+    concurrency = [int(c) for c in args.concurrency.split(",") if c.strip()]
+
+    model_name, column = serving_embedding(args)
+    ids, questions, answers, embeddings = load_corpus(args, column)
+    queries = load_queries(args, embeddings, model_name)
+    k = min(args.k, len(ids))
+    logger.info(f"Corpus {embeddings.shape[0]} x {embeddings.shape[1]}, {len(queries)} queries, k={k}")
+    truth = ground_truth(embeddings, queries, ids, k)
+
+    workspace = Workspace(ids, questions, answers, embeddings)
+    results = []
+    try:
+        for name in backends:
+            logger.info(f"Benchmarking {name}")
+            results.append(benchmark_backend(name, workspace, queries, truth, k, concurrency, column=column))
+    finally:
+        workspace.close()
+
+    print(format_results(results, concurrency))
+    print(f"(FAISS IVF backends re-rank {FAISS_RERANK_FACTOR}x shortlists when the store has float vectors)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"corpus": list(embeddings.shape), "queries": len(queries), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
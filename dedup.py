@@ -0,0 +1,255 @@
+# dedup.py
+# Streaming near-duplicate detection for ingestion
+#
+# Two stages, both keeping the first row of a cluster as its canonical row:
+#   TextDeduper       MinHash over character shingles of the normalized question, LSH
+#                     banding for candidates, estimated Jaccard >= threshold to confirm.
+#                     Runs before encoding, so text duplicates are never embedded.
+#   EmbeddingDeduper  random-hyperplane (SimHash) buckets over the question embedding,
+#                     exact cosine >= threshold against the candidates to confirm.
+#                     Catches paraphrases and translations MinHash can't see.
+#
+# Memory is bounded: each stage remembers at most max_canonical rows and forgets the
+# oldest ones first, so a 10M-row stream only compares against the most recent window.
+import logging
+import os
+import unicodedata
+import zlib
+from collections import OrderedDict, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEDUP_JACCARD_THRESHOLD = float(os.getenv("DEDUP_JACCARD_THRESHOLD", "0.8"))
+DEDUP_COSINE_THRESHOLD = float(os.getenv("DEDUP_COSINE_THRESHOLD", "0.95"))
+DEDUP_MAX_CANONICAL = int(os.getenv("DEDUP_MAX_CANONICAL", "200000"))
+
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16          # 16 bands x 4 rows: candidate pairs from Jaccard ~0.5 upwards
+SHINGLE_CHARS = 5
+SIMHASH_TABLES = 10
+SIMHASH_BITS = 12           # 12 bits x 10 tables: ~96% chance to bucket a cosine-0.95 pair together
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+
+
+def normalize_text(value: str) -> str:
+    # Case, punctuation and whitespace differences don't make a question different; works per
+    # character so Telugu/Hindi combining marks stay attached to their letters
+    kept = (ch for ch in unicodedata.normalize("NFKC", value or "").lower()
+            if not unicodedata.category(ch).startswith(("P", "S")))
+    return " ".join("".join(kept).split())
+
+
+def shingles(value: str, size: int = SHINGLE_CHARS) -> np.ndarray:
+    text = normalize_text(value)
+    if len(text) <= size:
+        grams = {text}
+    else:
+        grams = {text[i:i + size] for i in range(len(text) - size + 1)}
+    return np.fromiter((zlib.crc32(g.encode("utf-8")) for g in grams), dtype=np.uint64, count=len(grams))
+
+
+class _Window:
+    """Insertion-ordered canonical rows with FIFO eviction beyond max_canonical."""
+
+    def __init__(self, max_canonical: int):
+        self.max_canonical = max_canonical
+        self.entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self._next = 0
+
+    def add(self, entry: tuple) -> Tuple[int, List[Tuple[int, tuple]]]:
+        # Returns the new id and the (id, entry) pairs evicted to make room
+        slot = self._next
+        self._next += 1
+        self.entries[slot] = entry
+        evicted = []
+        while len(self.entries) > self.max_canonical:
+            evicted.append(self.entries.popitem(last=False))
+        return slot, evicted
+
+
+class TextDeduper:
+    """MinHash/LSH near-duplicate filter over question text."""
+
+    def __init__(self, threshold: float = DEDUP_JACCARD_THRESHOLD, num_perm: int = MINHASH_PERMUTATIONS,
+                 bands: int = MINHASH_BANDS, max_canonical: int = DEDUP_MAX_CANONICAL, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        rng = np.random.default_rng(seed)
+        # Universal hashing (a * x + b) mod p; a, x < 2^32 keeps the product inside uint64
+        self.a = rng.integers(1, _MAX_HASH, num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, _MAX_HASH, num_perm, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.window = _Window(max_canonical)
+        self.buckets: Dict[tuple, int] = {}
+
+    def signature(self, value: str) -> np.ndarray:
+        hashed = (np.outer(shingles(value), self.a) + self.b) % _MERSENNE_PRIME & _MAX_HASH
+        return hashed.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[tuple]:
+        r = self.rows_per_band
+        return [(band, signature[band * r:(band + 1) * r].tobytes()) for band in range(self.bands)]
+
+    def check(self, value: str) -> Tuple[Optional[int], Optional[tuple]]:
+        # Returns (canonical id, None) for a duplicate, else (None, state to pass to add())
+        signature = self.signature(value)
+        keys = self._band_keys(signature)
+        for candidate in {self.buckets[k] for k in keys if k in self.buckets}:
+            entry = self.window.entries.get(candidate)
+            if entry is not None and np.mean(entry[0] == signature) >= self.threshold:
+                return candidate, None
+        return None, (signature, keys)
+
+    def add(self, state: tuple) -> int:
+        signature, keys = state
+        slot, evicted = self.window.add((signature, keys))
+        for old_slot, (_, old_keys) in evicted:
+            for key in old_keys:
+                if self.buckets.get(key) == old_slot:
+                    del self.buckets[key]
+        for key in keys:
+            # Latest canonical wins the bucket; older ones stay reachable through their other bands
+            self.buckets[key] = slot
+        return slot
+
+
+class EmbeddingDeduper:
+    """SimHash-bucketed cosine near-duplicate filter over question embeddings."""
+
+    def __init__(self, dimension: int, threshold: float = DEDUP_COSINE_THRESHOLD, tables: int = SIMHASH_TABLES,
+                 bits: int = SIMHASH_BITS, max_canonical: int = DEDUP_MAX_CANONICAL, seed: int = 2):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((tables * bits, dimension)).astype(np.float32)
+        self.tables = tables
+        self.bits = bits
+        self.threshold = threshold
+        self.window = _Window(max_canonical)
+        self.buckets: Dict[tuple, List[int]] = defaultdict(list)
+        self._weights = (1 << np.arange(bits)).astype(np.int64)
+
+    def _keys(self, vectors: np.ndarray) -> np.ndarray:
+        # (n, tables) bucket ids from the sign pattern of each table's hyperplanes
+        signs = (vectors @ self.planes.T > 0).reshape(len(vectors), self.tables, self.bits)
+        return signs.astype(np.int64) @ self._weights
+
+    def filter(self, embeddings: np.ndarray) -> List[Tuple[bool, int]]:
+        # Per row: (is_duplicate, canonical id); a row that isn't a duplicate becomes canonical itself
+        vectors = embeddings.astype(np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.where(norms == 0, 1.0, norms)
+        keys = self._keys(vectors)
+        result: List[Tuple[bool, int]] = []
+        for vector, row_keys in zip(vectors, keys):
+            table_keys = [(t, int(k)) for t, k in enumerate(row_keys)]
+            candidates = {slot for key in table_keys for slot in self.buckets.get(key, ())}
+            duplicate_of = None
+            if candidates:
+                slots = [s for s in candidates if s in self.window.entries]
+                if slots:
+                    matrix = np.stack([self.window.entries[s][0] for s in slots]).astype(np.float32)
+                    scores = matrix @ vector
+                    best = int(np.argmax(scores))
+                    if scores[best] >= self.threshold:
+                        duplicate_of = slots[best]
+            if duplicate_of is not None:
+                result.append((True, duplicate_of))
+                continue
+            slot, evicted = self.window.add((vector.astype(np.float16), table_keys))
+            for old_slot, (_, old_keys) in evicted:
+                for key in old_keys:
+                    bucket = self.buckets.get(key)
+                    if bucket is not None:
+                        bucket.remove(old_slot)
+                        if not bucket:
+                            del self.buckets[key]
+            for key in table_keys:
+                self.buckets[key].append(slot)
+            result.append((False, slot))
+        return result
+
+
+class NearDuplicateFilter:
+    """Both stages plus counters and a report of dropped rows.
+
+    A row that matches its own stored version (same source_key, e.g. an edited answer) is an
+    update, not a duplicate, and is kept.
+    """
+
+    def __init__(self, jaccard_threshold: float = DEDUP_JACCARD_THRESHOLD,
+                 cosine_threshold: Optional[float] = DEDUP_COSINE_THRESHOLD,
+                 max_canonical: int = DEDUP_MAX_CANONICAL):
+        self.text = TextDeduper(jaccard_threshold, max_canonical=max_canonical)
+        self.cosine_threshold = cosine_threshold
+        self.max_canonical = max_canonical
+        self.embedding: Optional[EmbeddingDeduper] = None
+        # (stage, slot) -> (question, source_key) of canonical rows, for updates and the report
+        self.canonical: Dict[Tuple[str, int], Tuple[str, Optional[str]]] = {}
+        self.text_duplicates = 0
+        self.embedding_duplicates = 0
+        self.report: List[dict] = []
+
+    def _remember(self, stage: str, slot: int, row: dict):
+        self.canonical[(stage, slot)] = (row["question"], row.get("source_key"))
+        while len(self.canonical) > 2 * self.max_canonical:
+            self.canonical.pop(next(iter(self.canonical)))
+
+    def _is_duplicate(self, stage: str, slot: int, row: dict) -> bool:
+        canonical = self.canonical.get((stage, slot))
+        if canonical is not None and canonical[1] is not None and canonical[1] == row.get("source_key"):
+            return False
+        self.report.append({"stage": stage, "question": row["question"], "source": row.get("source"),
+                            "canonical": canonical[0] if canonical else None})
+        return True
+
+    def filter_text(self, rows: List[dict]) -> List[dict]:
+        kept = []
+        for row in rows:
+            duplicate_of, state = self.text.check(row["question"])
+            if duplicate_of is None:
+                self._remember("text", self.text.add(state), row)
+            elif self._is_duplicate("text", duplicate_of, row):
+                self.text_duplicates += 1
+                continue
+            kept.append(row)
+        return kept
+
+    def filter_embeddings(self, rows: List[dict], embeddings: np.ndarray) -> Tuple[List[dict], np.ndarray]:
+        if self.cosine_threshold is None or not len(rows):
+            return rows, embeddings
+        if self.embedding is None:
+            self.embedding = EmbeddingDeduper(embeddings.shape[1], self.cosine_threshold,
+                                              max_canonical=self.max_canonical)
+        keep = []
+        for i, (row, (duplicate, slot)) in enumerate(zip(rows, self.embedding.filter(embeddings))):
+            if not duplicate:
+                self._remember("embedding", slot, row)
+            elif self._is_duplicate("embedding", slot, row):
+                self.embedding_duplicates += 1
+                continue
+            keep.append(i)
+        return [rows[i] for i in keep], embeddings[keep]
+
+    def seed(self, rows: List[dict], embeddings: Optional[np.ndarray] = None):
+        # Make already-stored rows ({"question", "source_key"}) canonical so a new source is
+        # deduplicated against them; nothing is counted or reported for them
+        reported = len(self.report)
+        for row in rows:
+            _, state = self.text.check(row["question"])
+            if state is not None:
+                self._remember("text", self.text.add(state), row)
+        if embeddings is not None and len(rows):
+            counted = self.embedding_duplicates
+            self.filter_embeddings(rows, embeddings)
+            self.embedding_duplicates = counted
+        del self.report[reported:]
+
+    def drain_report(self) -> List[dict]:
+        report, self.report = self.report, []
+        return report
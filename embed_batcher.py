@@ -0,0 +1,106 @@
+# embed_batcher.py
+# Micro-batching of /query embeddings
+#
+# Each request used to run its own single-text model.encode in the threadpool, so N
+# concurrent users meant N forward passes of batch size 1 competing for the same cores.
+# EmbedBatcher queues the texts instead: a collector task takes whatever arrived within
+# EMBED_BATCH_MAX_WAIT_MS of the first text (at most EMBED_BATCH_MAX_SIZE), encodes them
+# in one forward pass and resolves each caller's future. While a batch is encoding the
+# next one accumulates, so batches grow with load and a lone request waits at most the
+# max wait.
+#
+# Texts are grouped by model object, so queries embedded during a model switch (or for
+# snapshots built with different models) are never mixed in one pass.
+import asyncio
+import logging
+import os
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+EMBED_BATCH_MAX_SIZE = int(os.getenv("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.getenv("EMBED_BATCH_MAX_WAIT_MS", "5"))
+# Log batch statistics every this many batches (0 = never)
+EMBED_BATCH_LOG_EVERY = int(os.getenv("EMBED_BATCH_LOG_EVERY", "1000"))
+
+
+class EmbedBatcher:
+    """Coalesces concurrent encode calls into batched forward passes."""
+
+    def __init__(self, max_batch: int = EMBED_BATCH_MAX_SIZE, max_wait_ms: float = EMBED_BATCH_MAX_WAIT_MS):
+        self.max_batch = max(max_batch, 1)
+        self.max_wait = max(max_wait_ms, 0.0) / 1000.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+
+    def _ensure_started(self):
+        # Started on first use, inside the serving event loop
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def encode(self, model, text: str) -> np.ndarray:
+        # One text -> its (d,) float32 vector, encoded together with whatever else is queued
+        self._ensure_started()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((model, text, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[object, str, asyncio.Future]]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            # Drain without waiting first; only sleep for stragglers while under the deadline
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect()
+            # Callers that went away (client disconnect) don't need encoding
+            batch = [item for item in batch if not item[2].done()]
+            groups = {}
+            for item in batch:
+                groups.setdefault(id(item[0]), []).append(item)
+            for items in groups.values():
+                await self._encode(items)
+
+    async def _encode(self, items: List[Tuple[object, str, asyncio.Future]]):
+        model = items[0][0]
+        started = time.perf_counter()
+        try:
+            vectors = await run_in_threadpool(
+                model.encode, [text for _, text, _ in items], batch_size=len(items), convert_to_numpy=True
+            )
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.encode_seconds += time.perf_counter() - started
+        for (_, _, future), vector in zip(items, vectors):
+            if not future.done():
+                future.set_result(np.asarray(vector, dtype=np.float32))
+        self.batches += 1
+        self.texts += len(items)
+        if EMBED_BATCH_LOG_EVERY and self.batches % EMBED_BATCH_LOG_EVERY == 0:
+            logger.info(f"Query embedding: {self.batches} batches, {self.texts / self.batches:.1f} texts/batch, "
+                        f"{1000 * self.encode_seconds / self.batches:.1f} ms/batch")
@@ -0,0 +1,158 @@
+# embedding_cache.py
+# Two-level cache of query embeddings in front of the encoder
+#
+#   1. in-process LRU (EMBED_CACHE_SIZE entries) of float32 vectors
+#   2. Redis, shared by all workers: raw float16 bytes under
+#      emb:<backend>:<model tag>:<sha256 of the normalized text>, expiring after EMBED_CACHE_TTL seconds
+#
+# Keys are the text after NFKC normalization, whitespace collapsing and case folding, so
+# "How to control aphids?" and "how to  control aphids?" share one entry; the vector
+# stored is that of the first spelling encoded. Keys include the model and the inference
+# backend (torch, onnx-fp32, onnx-int8), so workers on different models or backends never
+# read each other's vectors. Concurrent misses for the same text wait on a single encode.
+#
+# Redis is an optimization only: if it is unreachable the lookup falls through to the encoder.
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+import numpy as np
+
+from embedding_models import EMBED_BACKEND
+from onnx_embedder import EMBED_ONNX_QUANTIZED
+
+logger = logging.getLogger(__name__)
+
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))
+EMBED_CACHE_TTL = int(os.getenv("EMBED_CACHE_TTL", str(7 * 24 * 3600)))
+# Log hit rates every this many lookups (0 = never)
+EMBED_CACHE_LOG_EVERY = int(os.getenv("EMBED_CACHE_LOG_EVERY", "1000"))
+REDIS_PREFIX = "emb"
+# Runtime the vectors come from: int8 ONNX vectors are close to torch fp32 ones, not equal
+EMBED_CACHE_BACKEND = EMBED_BACKEND if EMBED_BACKEND != "onnx" else ("onnx-int8" if EMBED_ONNX_QUANTIZED else "onnx-fp32")
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(value: str) -> str:
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", value)).strip().casefold()
+
+
+def cache_key(model_name: str, value: str, backend: str = EMBED_CACHE_BACKEND) -> str:
+    model_tag = hashlib.sha1(model_name.encode("utf-8")).hexdigest()[:10]
+    digest = hashlib.sha256(normalize_text(value).encode("utf-8")).hexdigest()
+    return f"{REDIS_PREFIX}:{backend}:{model_tag}:{digest}"
+
+
+class EmbeddingCache:
+    """Local LRU + Redis float16 store of query vectors, with hit/miss counters."""
+
+    def __init__(self, redis=None, max_entries: int = EMBED_CACHE_SIZE, ttl: int = EMBED_CACHE_TTL):
+        self.redis = redis
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+
+    def stats(self) -> dict:
+        lookups = self.local_hits + self.redis_hits + self.misses
+        return {
+            "lookups": lookups,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else 0.0,
+            "redis_errors": self.redis_errors,
+            "local_entries": len(self._local),
+        }
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        self._local[key] = vector
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def _redis_get(self, key: str) -> Optional[np.ndarray]:
+        if self.redis is None:
+            return None
+        try:
+            data = await self.redis.get(key)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Embedding cache read failed: {str(e)}")
+            return None
+        return np.frombuffer(data, dtype=np.float16).astype(np.float32) if data else None
+
+    async def _redis_set(self, key: str, vector: np.ndarray):
+        if self.redis is None:
+            return
+        try:
+            await self.redis.set(key, vector.astype(np.float16).tobytes(), ex=self.ttl)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f"Embedding cache write failed: {str(e)}")
+
+    def _count(self, attr: str):
+        setattr(self, attr, getattr(self, attr) + 1)
+        lookups = self.local_hits + self.redis_hits + self.misses
+        if EMBED_CACHE_LOG_EVERY and lookups % EMBED_CACHE_LOG_EVERY == 0:
+            logger.info(f"Embedding cache: {self.stats()}")
+
+    async def get_or_encode(self, model_name: str, value: str,
+                            encode: Callable[[str], Awaitable[np.ndarray]]) -> np.ndarray:
+        # (d,) float32 vector of value under model_name; encode(value) runs only on a miss
+        key = cache_key(model_name, value)
+        vector = self._local.get(key)
+        if vector is not None:
+            self._local.move_to_end(key)
+            self._count("local_hits")
+            return vector
+        pending = self._inflight.get(key)
+        if pending is not None:
+            # Same text already being looked up by another request
+            try:
+                vector = await asyncio.shield(pending)
+                self._count("local_hits")
+                return vector
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # That request went away before finishing; look it up ourselves
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            vector = await self._redis_get(key)
+            if vector is not None:
+                self._count("redis_hits")
+            else:
+                self._count("misses")
+                vector = np.array(await encode(value), dtype=np.float32)
+                await self._redis_set(key, vector)
+            # Shared by every request that hits it
+            vector.setflags(write=False)
+            self._remember(key, vector)
+            future.set_result(vector)
+            return vector
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Marks the exception retrieved, so a miss nobody else waited on doesn't log a warning
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
@@ -0,0 +1,220 @@
+# embedding_models.py
+# Embedding models the knowledge base can be built with, and which one is serving
+#
+# EMBEDDING_MODELS pins the output dimension of every supported model, so a model that
+# doesn't fit the column, index or snapshot it is paired with fails at startup with a
+# clear message instead of at the first query.
+#
+# kb_embedding_columns records which knowledge_base column holds which model's vectors:
+#   embedding          the original column
+#   embedding_<tag>    shadow columns added by reembed.py when the model changes
+# Exactly one row is 'active': ingestion writes that column and pgvector queries read it.
+# A shadow column goes 'building' -> 'ready' (filled and indexed) -> 'active', and the
+# column it replaces becomes 'retired' until reembed.py drop-retired removes it.
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Model name -> embedding dimension
+EMBEDDING_MODELS: Dict[str, int] = {
+    "sentence-transformers/distiluse-base-multilingual-cased-v1": 512,
+    "sentence-transformers/distiluse-base-multilingual-cased-v2": 512,
+    "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2": 384,
+    "sentence-transformers/paraphrase-multilingual-mpnet-base-v2": 768,
+    "sentence-transformers/LaBSE": 768,
+    "sentence-transformers/all-MiniLM-L6-v2": 384,
+}
+DEFAULT_EMBED_MODEL = "sentence-transformers/distiluse-base-multilingual-cased-v1"
+EMBED_MODEL_NAME = os.getenv("EMBED_MODEL", DEFAULT_EMBED_MODEL)
+# Dimension of an EMBED_MODEL missing from EMBEDDING_MODELS (0 = refuse unknown models)
+EMBED_MODEL_DIMENSION = int(os.getenv("EMBED_MODEL_DIMENSION", "0"))
+# Loaded models kept per process: the serving one plus the one being switched to
+EMBED_MODEL_CACHE = int(os.getenv("EMBED_MODEL_CACHE", "2"))
+# Inference runtime: "torch" (SentenceTransformer) or "onnx" (exported int8 graph, onnx_embedder.py)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch").lower()
+
+TABLE = "knowledge_base"
+DEFAULT_COLUMN = "embedding"
+# Column names are inlined into SQL, so only embedding / embedding_<tag> are accepted
+COLUMN_NAME = re.compile(r"^embedding(_[a-z0-9]{1,40})?$")
+
+REGISTRY_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS kb_embedding_columns (
+        column_name VARCHAR(63) PRIMARY KEY,
+        model VARCHAR NOT NULL,
+        dimension INTEGER NOT NULL,
+        state VARCHAR(16) NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT now(),
+        activated_at TIMESTAMP
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_kb_embedding_columns_active ON kb_embedding_columns (state) WHERE state = 'active'",
+]
+
+# Transaction-scoped lock serializing registry bootstraps across processes
+REGISTRY_LOCK_SQL = "SELECT pg_advisory_xact_lock(hashtext('kb_embedding_columns'))"
+ACTIVE_EMBEDDING_SQL = "SELECT column_name, model, dimension FROM kb_embedding_columns WHERE state = 'active'"
+# Column holding a model's vectors; a retired column still serves workers that haven't switched yet
+MODEL_COLUMN_SQL = (
+    "SELECT column_name, model, dimension FROM kb_embedding_columns "
+    "WHERE model = :model AND state IN ('active', 'retired') "
+    "ORDER BY state = 'active' DESC, activated_at DESC NULLS LAST LIMIT 1"
+)
+READY_MODELS_SQL = "SELECT model FROM kb_embedding_columns WHERE state = 'ready'"
+COLUMN_TYPMOD_SQL = (
+    "SELECT atttypmod FROM pg_attribute "
+    "WHERE attrelid = 'knowledge_base'::regclass AND attname = :column AND NOT attisdropped"
+)
+
+
+class ActiveEmbedding(NamedTuple):
+    column: str
+    model: str
+    dimension: int
+
+
+def model_dimension(name: str) -> int:
+    if name in EMBEDDING_MODELS:
+        return EMBEDDING_MODELS[name]
+    if EMBED_MODEL_DIMENSION > 0:
+        return EMBED_MODEL_DIMENSION
+    raise ValueError(f"Unknown embedding model {name!r}; add it to EMBEDDING_MODELS or set EMBED_MODEL_DIMENSION")
+
+
+def check_dimension(name: str, dimension: int, what: str):
+    # what: the vector store being paired with the model, e.g. "knowledge_base.embedding"
+    expected = model_dimension(name)
+    if dimension and dimension != expected:
+        raise RuntimeError(f"{what} holds {dimension}-d vectors but {name} produces {expected}-d vectors")
+
+
+def check_column(column: str) -> str:
+    if not COLUMN_NAME.match(column or ""):
+        raise ValueError(f"Invalid embedding column: {column!r}")
+    return column
+
+
+def shadow_column(model: str) -> str:
+    # Stable per model, so an interrupted migration resumes into the same column
+    return f"{DEFAULT_COLUMN}_{hashlib.sha1(model.encode('utf-8')).hexdigest()[:10]}"
+
+
+def load_model(name: str):
+    if EMBED_BACKEND == "onnx":
+        from onnx_embedder import load_onnx_model
+
+        return load_onnx_model(name)
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(name)
+    check_dimension(name, model.get_sentence_embedding_dimension(), f"{name} as loaded")
+    return model
+
+
+def embedding_from_row(row) -> Optional[ActiveEmbedding]:
+    return ActiveEmbedding(check_column(row[0]), row[1], int(row[2])) if row else None
+
+
+def active_embedding(conn) -> Optional[ActiveEmbedding]:
+    # None before the registry exists (e.g. a database no app worker has initialized yet)
+    if conn.execute(text("SELECT to_regclass('kb_embedding_columns')")).scalar() is None:
+        return None
+    return embedding_from_row(conn.execute(text(ACTIVE_EMBEDDING_SQL)).fetchone())
+
+
+def column_for_model(conn, model: str) -> Optional[ActiveEmbedding]:
+    if conn.execute(text("SELECT to_regclass('kb_embedding_columns')")).scalar() is None:
+        return None
+    return embedding_from_row(conn.execute(text(MODEL_COLUMN_SQL), {"model": model}).fetchone())
+
+
+def column_dimension(conn, column: str) -> Optional[int]:
+    # pgvector stores the declared dimension as the column's typmod (-1 when undeclared)
+    typmod = conn.execute(text(COLUMN_TYPMOD_SQL), {"column": column}).scalar()
+    return typmod if typmod and typmod > 0 else None
+
+
+def bootstrap_registry(conn, model: str = EMBED_MODEL_NAME) -> ActiveEmbedding:
+    # Sync connection (app.py runs it through AsyncConnection.run_sync). The first run records
+    # knowledge_base.embedding as holding EMBED_MODEL; afterwards the registry wins over EMBED_MODEL.
+    # Workers starting together on a fresh database take turns (until the caller's transaction
+    # ends), so only one of them creates the registry and retypes the column.
+    conn.execute(text(REGISTRY_LOCK_SQL))
+    for stmt in REGISTRY_DDL:
+        conn.execute(text(stmt))
+    active = embedding_from_row(conn.execute(text(ACTIVE_EMBEDDING_SQL)).fetchone())
+    if active is not None:
+        if active.model != model:
+            logger.warning(f"EMBED_MODEL={model} ignored: knowledge_base serves {active.model} "
+                           f"(switch with `python reembed.py start {model}`)")
+        return active
+
+    dimension = model_dimension(model)
+    declared = column_dimension(conn, DEFAULT_COLUMN)
+    if declared and declared != dimension:
+        populated = conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {TABLE} WHERE {DEFAULT_COLUMN} IS NOT NULL)")).scalar()
+        if populated:
+            raise RuntimeError(
+                f"knowledge_base.{DEFAULT_COLUMN} is vector({declared}) but {model} produces {dimension}-d vectors; "
+                f"set EMBED_MODEL to the model that embedded the stored rows"
+            )
+        # Nothing stored yet: retype the column (its vector indexes are rebuilt by ensure_vector_index)
+        for (name,) in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :table AND indexdef LIKE '%' || :column || '%'"
+        ), {"table": TABLE, "column": DEFAULT_COLUMN}).fetchall():
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text(f"ALTER TABLE {TABLE} ALTER COLUMN {DEFAULT_COLUMN} TYPE vector({dimension})"))
+        logger.info(f"Retyped empty knowledge_base.{DEFAULT_COLUMN} from vector({declared}) to vector({dimension})")
+    conn.execute(text(
+        "INSERT INTO kb_embedding_columns (column_name, model, dimension, state, activated_at) "
+        "VALUES (:column, :model, :dimension, 'active', now()) ON CONFLICT DO NOTHING"
+    ), {"column": DEFAULT_COLUMN, "model": model, "dimension": dimension})
+    # Whatever row is active now, ours or one registered without the lock (an older worker)
+    return embedding_from_row(conn.execute(text(ACTIVE_EMBEDDING_SQL)).fetchone())
+
+
+class EmbedderHolder:
+    """Serving (column, model) pair for query embedding, swapped as one reference.
+
+    Requests read ``holder.current`` once, so a query is always embedded with the model
+    whose vectors the column it searches holds, even while a cutover is being picked up.
+    """
+
+    def __init__(self, active: ActiveEmbedding):
+        self._models: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.current: Tuple[ActiveEmbedding, object] = (active, self.model(active.model))
+
+    def model(self, name: str):
+        # Loading under the lock keeps concurrent callers from loading the same model twice; loads are rare
+        with self._lock:
+            if name in self._models:
+                self._models.move_to_end(name)
+                return self._models[name]
+            logger.info(f"Loading embedding model {name}")
+            model = load_model(name)
+            self._models[name] = model
+            while len(self._models) > max(EMBED_MODEL_CACHE, 1):
+                self._models.popitem(last=False)
+            return model
+
+    def cached(self, name: str):
+        # Non-blocking lookup for the event loop: the loaded model or None, never waits on a load
+        return self._models.get(name)
+
+    def activate(self, active: ActiveEmbedding) -> bool:
+        # Loads the model fully before swapping; a failed load leaves the old pair serving
+        if active == self.current[0]:
+            return False
+        self.current = (active, self.model(active.model))
+        logger.info(f"Serving {active.model} from knowledge_base.{active.column}")
+        return True
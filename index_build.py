@@ -0,0 +1,162 @@
+# index_build.py
+# FAISS index construction for setup_artifacts.py: flat, IVF-PQ and OPQ+IVF-PQ, with a
+# memory and recall@k report against exact search
+import logging
+import math
+import os
+import time
+
+import faiss
+import numpy as np
+
+from retrieval import FAISS_NPROBE, FAISS_RERANK_FACTOR, rerank_exact
+
+logger = logging.getLogger(__name__)
+
+# "flat" (exact), "ivfpq" or "opq_ivfpq"
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat").lower()
+IVF_NLIST = int(os.getenv("IVF_NLIST", "0"))        # 0 = 4 * sqrt(n)
+PQ_M = int(os.getenv("PQ_M", "0"))                  # sub-quantizers (must divide dimension), 0 = ~dimension / 8
+PQ_NBITS = int(os.getenv("PQ_NBITS", "8"))
+# faiss wants roughly 39 training points per centroid; below this, compression isn't worth it
+MIN_TRAIN_POINTS_PER_CENTROID = 39
+TRAIN_SAMPLE = int(os.getenv("IVF_TRAIN_SAMPLE", "200000"))
+# Rows scored per block by the exact search behind the recall report
+EXACT_BLOCK_ROWS = int(os.getenv("EXACT_BLOCK_ROWS", "65536"))
+
+
+def default_pq_m(dimension: int) -> int:
+    m = max(dimension // 8, 1)
+    while dimension % m:
+        m -= 1
+    return m
+
+
+def index_factory_string(index_type: str, dimension: int, nlist: int, m: int, nbits: int = PQ_NBITS) -> str:
+    if index_type == "flat":
+        return "Flat"
+    if index_type == "ivfpq":
+        return f"IVF{nlist},PQ{m}x{nbits}"
+    if index_type == "opq_ivfpq":
+        # OPQ rotates the space so PQ sub-vectors carry balanced variance, which recovers recall at the same code size
+        return f"OPQ{m},IVF{nlist},PQ{m}x{nbits}"
+    raise ValueError(f"Unknown FAISS_INDEX_TYPE: {index_type}")
+
+
+def new_faiss_index(n: int, dimension: int, index_type: str = FAISS_INDEX_TYPE, nlist: int = IVF_NLIST,
+                    m: int = PQ_M, nbits: int = PQ_NBITS):
+    # Empty (untrained) index sized for n vectors; returns (index, factory string)
+    nlist = nlist or max(min(int(4 * math.sqrt(n)), n // MIN_TRAIN_POINTS_PER_CENTROID), 1)
+    m = m or default_pq_m(dimension)
+    if index_type != "flat" and n < max(nlist * MIN_TRAIN_POINTS_PER_CENTROID, (1 << nbits) * MIN_TRAIN_POINTS_PER_CENTROID):
+        logger.warning(f"{n} vectors are too few to train {index_type} (nlist={nlist}, nbits={nbits}), building a flat index")
+        index_type = "flat"
+
+    factory = index_factory_string(index_type, dimension, nlist, m, nbits)
+    return faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT), factory
+
+
+def train_faiss_index(index, sample: np.ndarray):
+    started = time.time()
+    index.train(sample)
+    logger.info(f"Trained index on {len(sample)} vectors in {time.time() - started:.1f}s")
+
+
+def build_faiss_index(embeddings: np.ndarray, index_type: str = FAISS_INDEX_TYPE, nlist: int = IVF_NLIST,
+                      m: int = PQ_M, nbits: int = PQ_NBITS):
+    # embeddings must already be L2-normalized float32 (inner product == cosine)
+    n, dimension = embeddings.shape
+    index, factory = new_faiss_index(n, dimension, index_type, nlist, m, nbits)
+    if not index.is_trained:
+        rng = np.random.default_rng(0)
+        sample = embeddings if n <= TRAIN_SAMPLE else embeddings[np.sort(rng.choice(n, TRAIN_SAMPLE, replace=False))]
+        train_faiss_index(index, sample)
+    index.add(embeddings)
+    return index, factory
+
+
+def index_bytes_per_vector(index) -> float:
+    # Per-vector RAM of the stored codes (+ 8-byte ids kept in IVF inverted lists)
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return ivf.code_size + 8
+    return index.sa_code_size() if hasattr(index, "sa_code_size") else index.d * 4
+
+
+def exact_search(queries: np.ndarray, embeddings: np.ndarray, k: int, block_rows: int = EXACT_BLOCK_ROWS) -> np.ndarray:
+    # Exact inner-product top-k ids, one block of rows at a time, so a memory-mapped corpus is
+    # never loaded (or copied into a flat index) whole
+    heap = faiss.ResultHeap(len(queries), k, keep_max=True)
+    for start in range(0, len(embeddings), block_rows):
+        block = np.asarray(embeddings[start:start + block_rows], dtype=np.float32)
+        ids = np.arange(start, start + len(block), dtype=np.int64)
+        heap.add_result(np.ascontiguousarray(queries @ block.T), np.tile(ids, (len(queries), 1)))
+    heap.finalize()
+    return heap.I
+
+
+def recall_at_k(index, embeddings: np.ndarray, k: int = 10, n_queries: int = 1000, nprobe: int = FAISS_NPROBE,
+                rerank_factor: int = 0) -> dict:
+    # Queries are a sample of the corpus itself; ground truth is exact inner-product search.
+    # embeddings may be a memmap: only the sampled queries and one block at a time are read.
+    rng = np.random.default_rng(1)
+    n = len(embeddings)
+    queries = np.ascontiguousarray(embeddings[np.sort(rng.choice(n, min(n_queries, n), replace=False))],
+                                   dtype=np.float32)
+    k = min(k, n)
+
+    truth = exact_search(queries, embeddings, k)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = nprobe
+    fetch = k * rerank_factor if rerank_factor and ivf is not None else k
+    started = time.perf_counter()
+    _, found = index.search(queries, fetch)
+    if fetch > k:
+        _, found = rerank_exact(queries, found, embeddings, k)
+    elapsed = time.perf_counter() - started
+
+    hits = sum(len(set(t) & set(f[f >= 0])) for t, f in zip(truth, found))
+    return {
+        "k": k,
+        "queries": len(queries),
+        "recall": hits / (len(queries) * k),
+        "ms_per_query": 1000 * elapsed / len(queries),
+    }
+
+
+def build_report(index, factory: str, embeddings: np.ndarray, k: int = 10, nprobe: int = FAISS_NPROBE,
+                 rerank_factor: int = FAISS_RERANK_FACTOR) -> dict:
+    n, dimension = embeddings.shape
+    bytes_per_vector = index_bytes_per_vector(index)
+    report = {
+        "factory": factory,
+        "vectors": n,
+        "dimension": dimension,
+        "bytes_per_vector": bytes_per_vector,
+        "mib_per_million_vectors": bytes_per_vector * 1_000_000 / 2**20,
+        "flat_mib_per_million_vectors": dimension * 4 * 1_000_000 / 2**20,
+        "serialized_bytes": int(faiss.serialize_index(index).nbytes),
+        "nprobe": nprobe,
+        "recall": recall_at_k(index, embeddings, k=k, nprobe=nprobe),
+    }
+    if faiss.try_extract_index_ivf(index) is not None:
+        report["recall_reranked"] = recall_at_k(index, embeddings, k=k, nprobe=nprobe, rerank_factor=rerank_factor)
+        report["rerank_factor"] = rerank_factor
+    return report
+
+
+def format_report(report: dict) -> str:
+    lines = [
+        f"Index {report['factory']}: {report['vectors']} x {report['dimension']}",
+        f"  {report['bytes_per_vector']:.0f} B/vector, {report['mib_per_million_vectors']:.1f} MiB per 1M vectors "
+        f"(flat float32: {report['flat_mib_per_million_vectors']:.1f} MiB)",
+        f"  recall@{report['recall']['k']} = {report['recall']['recall']:.3f} "
+        f"({report['recall']['ms_per_query']:.3f} ms/query, nprobe={report['nprobe']})",
+    ]
+    if "recall_reranked" in report:
+        rr = report["recall_reranked"]
+        lines.append(f"  recall@{rr['k']} with float rerank of {report['rerank_factor']}x shortlist = {rr['recall']:.3f} "
+                     f"({rr['ms_per_query']:.3f} ms/query)")
+    return "\n".join(lines)
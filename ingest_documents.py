@@ -0,0 +1,465 @@
+# ingest_documents.py
+# Streaming ingestion of long documents (agronomy manuals, extension bulletins) into knowledge_base
+#
+# Plain text, Markdown and HTML files are split along their headings into sections, and
+# sections into overlapping chunks of at most --chunk-tokens tokens of the embedding
+# model's tokenizer, cut at sentence boundaries. Each chunk becomes a knowledge_base row:
+#   question      heading path, e.g. "Rice Production Manual > Nursery > Seed treatment"
+#   answer        the chunk text
+#   document_id   the kb_documents row of its file, chunk_index its position
+# so retrieval serves a few hundred tokens of the right section instead of a whole manual.
+# Heading path and text are embedded together (ingest.embedding_text).
+#
+# Chunks go through the same embedder and COPY upsert as ingest.py. A file whose content
+# and chunking settings are unchanged is skipped. Chunks are keyed by position (uri#index),
+# so an edited file re-embeds the positions whose text changed: an edit near the end costs a
+# chunk or two, text inserted near the start shifts and re-embeds every chunk after it. Rows
+# past the file's new last chunk are deleted.
+#
+# Usage (run separately):
+#   python ingest_documents.py manuals/ --source icar_manuals
+#   python ingest_documents.py bulletins/ --source extension_bulletins --language te --category pest_control --workers 4
+import argparse
+import hashlib
+import logging
+import os
+import re
+import time
+from html.parser import HTMLParser
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import text
+
+from embedding_models import EMBED_MODEL_NAME, check_dimension
+from ingest import (DATABASE_URL, INGEST_BATCH_SIZE, INGEST_CHUNK_ROWS, INGEST_SHARD_ROWS, INGEST_WORKERS, Embedder,
+                    KnowledgeBaseWriter, PoolEmbedder, Progress)
+from kb_store import content_hash, source_key
+
+logger = logging.getLogger(__name__)
+
+# Token budget per chunk (capped by the model's max_seq_length) and tokens repeated between chunks
+DOC_CHUNK_TOKENS = int(os.getenv("DOC_CHUNK_TOKENS", "256"))
+DOC_CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "32"))
+
+FORMATS = {".txt": "text", ".text": "text", ".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html"}
+HEADING_SEPARATOR = " > "
+
+# Sentence ends (Latin and Devanagari danda) and line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?।॥])\s+|\n+")
+MARKDOWN_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+MARKDOWN_INLINE = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),      # images -> alt text
+    (re.compile(r"\[([^\]]*)\]\([^)]*\)"), r"\1"),       # links -> link text
+    (re.compile(r"`([^`]*)`"), r"\1"),
+    (re.compile(r"(\*\*|__|\*|_|~~)(?=\S)(.+?)(?<=\S)\1"), r"\2"),
+    (re.compile(r"<[^>]+>"), ""),
+    (re.compile(r"^\s*(?:[-*+]|\d+[.)])\s+", re.MULTILINE), ""),   # list markers
+    (re.compile(r"^\s*>\s?", re.MULTILINE), ""),                  # block quotes
+    (re.compile(r"^\s*\|?[-:| ]+\|[-:| ]*$", re.MULTILINE), ""),  # table separator rows
+    (re.compile(r"\s*\|\s*"), " "),
+]
+
+
+class Section(NamedTuple):
+    headings: Tuple[str, ...]
+    text: str
+
+
+class Document(NamedTuple):
+    uri: str
+    title: str
+    sections: List[Section]
+    raw: str
+
+
+def _clean(value: str) -> str:
+    # Collapse runs of spaces, keep paragraph breaks as sentence boundaries
+    lines = [" ".join(line.split()) for line in value.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def parse_text(raw: str) -> Tuple[Optional[str], List[Section]]:
+    return None, [Section((), _clean(raw))]
+
+
+def parse_markdown(raw: str) -> Tuple[Optional[str], List[Section]]:
+    title = None
+    sections: List[Section] = []
+    stack: List[Tuple[int, str]] = []
+    lines: List[str] = []
+    in_code = False
+
+    def flush():
+        body = "\n".join(lines)
+        for pattern, replacement in MARKDOWN_INLINE:
+            body = pattern.sub(replacement, body)
+        body = _clean(body)
+        if body:
+            sections.append(Section(tuple(h for _, h in stack), body))
+        lines.clear()
+
+    for line in raw.splitlines():
+        if line.lstrip().startswith(("```", "~~~")):
+            in_code = not in_code
+            continue
+        match = None if in_code else MARKDOWN_HEADING.match(line)
+        if match is None:
+            lines.append(line)
+            continue
+        flush()
+        level, heading = len(match.group(1)), match.group(2).strip()
+        if level == 1 and title is None:
+            title = heading
+            stack = []
+            continue
+        while stack and stack[-1][0] >= level:
+            stack.pop()
+        stack.append((level, heading))
+    flush()
+    return title, sections
+
+
+class _HTMLSections(HTMLParser):
+    """Collects text between headings; scripts, styles and page chrome are dropped."""
+
+    SKIP = {"script", "style", "noscript", "nav", "header", "footer", "svg", "form"}
+    BLOCKS = {"p", "div", "li", "br", "tr", "section", "article", "pre", "blockquote", "table", "ul", "ol", "dd", "dt"}
+    HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title: Optional[str] = None
+        self.first_h1: Optional[str] = None
+        self.sections: List[Section] = []
+        self._stack: List[Tuple[int, str]] = []
+        self._text: List[str] = []
+        self._heading: Optional[Tuple[int, List[str]]] = None
+        self._in_title = False
+        self._skip_depth = 0
+
+    def _flush(self):
+        body = _clean("".join(self._text))
+        if body:
+            self.sections.append(Section(tuple(h for _, h in self._stack), body))
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIP:
+            self._skip_depth += 1
+        elif tag == "title":
+            self._in_title = True
+        elif tag in self.HEADINGS and not self._skip_depth:
+            self._flush()
+            self._heading = (self.HEADINGS[tag], [])
+        elif tag in self.BLOCKS:
+            self._text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIP:
+            self._skip_depth = max(self._skip_depth - 1, 0)
+        elif tag == "title":
+            self._in_title = False
+        elif tag in self.HEADINGS and self._heading is not None:
+            level, parts = self._heading
+            heading = " ".join("".join(parts).split())
+            self._heading = None
+            if not heading:
+                return
+            if level == 1 and self.first_h1 is None:
+                self.first_h1 = heading
+                self._stack = []
+                return
+            while self._stack and self._stack[-1][0] >= level:
+                self._stack.pop()
+            self._stack.append((level, heading))
+        elif tag in self.BLOCKS:
+            self._text.append("\n")
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title = " ".join(((self.title or "") + data).split())
+        elif self._skip_depth:
+            return
+        elif self._heading is not None:
+            self._heading[1].append(data)
+        else:
+            self._text.append(data)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+
+def parse_html(raw: str) -> Tuple[Optional[str], List[Section]]:
+    parser = _HTMLSections()
+    parser.feed(raw)
+    parser.close()
+    return parser.first_h1 or parser.title, parser.sections
+
+
+PARSERS = {"text": parse_text, "markdown": parse_markdown, "html": parse_html}
+
+
+def read_document(path: Path, root: Path, fmt: Optional[str] = None) -> Document:
+    raw = path.read_text(encoding="utf-8", errors="replace")
+    title, sections = PARSERS[fmt or FORMATS[path.suffix.lower()]](raw)
+    # Relative to the ingested directory, so re-running from elsewhere updates the same document
+    uri = path.relative_to(root).as_posix() if path != root else path.name
+    return Document(uri, title or path.stem.replace("_", " ").replace("-", " "), sections, raw)
+
+
+def iter_paths(root: Path) -> Iterator[Path]:
+    if root.is_file():
+        yield root
+        return
+    for path in sorted(root.rglob("*")):
+        if path.is_file() and path.suffix.lower() in FORMATS:
+            yield path
+
+
+class TokenCounter:
+    """Counts tokens with the embedding model's tokenizer (falls back to words and punctuation)."""
+
+    def __init__(self, model_name: str):
+        try:
+            from transformers import AutoTokenizer
+
+            self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        except Exception as e:
+            logger.warning(f"Tokenizer for {model_name} unavailable, approximating token counts: {str(e)}")
+            self.tokenizer = None
+
+    def __call__(self, value: str) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer.tokenize(value))
+        # Subword tokenizers split most words into 1-2 pieces
+        return int(len(re.findall(r"\w+|[^\w\s]", value)) * 1.3) + 1
+
+
+def chunk_text(value: str, count_tokens: Callable[[str], int], max_tokens: int, overlap_tokens: int) -> List[str]:
+    # Greedily packs sentences up to max_tokens; each chunk starts with the last sentences of the
+    # previous one (up to overlap_tokens) so a fact split across the boundary stays retrievable
+    units: List[Tuple[str, int]] = []
+    for sentence in SENTENCE_BOUNDARY.split(value):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        n = count_tokens(sentence)
+        if n <= max_tokens:
+            units.append((sentence, n))
+            continue
+        # A sentence longer than a chunk (tables, OCR run-ons) is cut at word boundaries
+        words: List[str] = []
+        total = 0
+        for word in sentence.split():
+            w = count_tokens(word)
+            if words and total + w > max_tokens:
+                units.append((" ".join(words), total))
+                words, total = [], 0
+            words.append(word)
+            total += w
+        if words:
+            units.append((" ".join(words), total))
+
+    chunks: List[str] = []
+    current: List[Tuple[str, int]] = []
+    total = 0
+    for unit, n in units:
+        if current and total + n > max_tokens:
+            chunks.append(" ".join(u for u, _ in current))
+            carry: List[Tuple[str, int]] = []
+            carried = 0
+            for u, m in reversed(current):
+                if carried + m > overlap_tokens:
+                    break
+                carry.insert(0, (u, m))
+                carried += m
+            while carry and carried + n > max_tokens:
+                carried -= carry.pop(0)[1]
+            current, total = carry, carried
+        current.append((unit, n))
+        total += n
+    if current:
+        chunks.append(" ".join(u for u, _ in current))
+    return chunks
+
+
+def document_hash(document: Document, model_name: str, chunk_tokens: int, overlap_tokens: int) -> str:
+    # Unchanged text chunked and embedded the same way -> nothing to do for this file
+    data = "\x1f".join((document.raw, model_name, str(chunk_tokens), str(overlap_tokens)))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def chunk_rows(document: Document, document_id: int, source: str, language: str, category: Optional[str],
+               model_name: str, count_tokens: Callable[[str], int], chunk_tokens: int, overlap_tokens: int) -> List[Dict]:
+    rows = []
+    for section in document.sections:
+        heading = HEADING_SEPARATOR.join((document.title,) + section.headings)
+        # The heading path is embedded with every chunk, so it comes out of the budget (+ special tokens)
+        budget = max(chunk_tokens - count_tokens(heading) - 3, 16)
+        for chunk in chunk_text(section.text, count_tokens, budget, min(overlap_tokens, budget // 2)):
+            index = len(rows)
+            rows.append({
+                "question": heading,
+                "answer": chunk,
+                "language": language,
+                "category": category,
+                "source": source,
+                "source_key": source_key(source, f"{document.uri}#{index}", language),
+                "content_hash": content_hash(heading, chunk, language, model_name),
+                "document_id": document_id,
+                "chunk_index": index,
+            })
+    return rows
+
+
+class DocumentWriter(KnowledgeBaseWriter):
+    """KnowledgeBaseWriter plus the kb_documents bookkeeping."""
+
+    def begin_document(self, source: str, document: Document, language: str,
+                       category: Optional[str]) -> Tuple[int, Optional[str]]:
+        # Returns the document id and the content hash stored by its last completed ingestion
+        with self.engine.begin() as conn:
+            row = conn.execute(text(
+                "INSERT INTO kb_documents (source, uri, title, language, category) "
+                "VALUES (:source, :uri, :title, :language, :category) "
+                "ON CONFLICT (source, uri) DO UPDATE SET title = EXCLUDED.title, language = EXCLUDED.language, "
+                "category = EXCLUDED.category "
+                "RETURNING id, content_hash"
+            ), {"source": source, "uri": document.uri, "title": document.title, "language": language,
+                "category": category}).fetchone()
+        return row[0], row[1]
+
+    def finish_document(self, document_id: int, chunk_count: int, digest: str):
+        # Only after all its chunks are written, so an interrupted run re-processes the file
+        with self.engine.begin() as conn:
+            conn.execute(text("DELETE FROM knowledge_base WHERE document_id = :id AND chunk_index >= :count"),
+                         {"id": document_id, "count": chunk_count})
+            conn.execute(text(
+                "UPDATE kb_documents SET content_hash = :hash, chunk_count = :count, updated_at = now() WHERE id = :id"
+            ), {"id": document_id, "count": chunk_count, "hash": digest})
+
+
+def ingest_documents(root: Path, source: str, language: str = "en", category: Optional[str] = None,
+                     fmt: Optional[str] = None, chunk_tokens: int = DOC_CHUNK_TOKENS,
+                     overlap_tokens: int = DOC_CHUNK_OVERLAP, batch_rows: int = INGEST_CHUNK_ROWS,
+                     batch_size: int = INGEST_BATCH_SIZE, method: str = "copy", model_name: Optional[str] = None,
+                     database_url: str = DATABASE_URL, workers: int = INGEST_WORKERS,
+                     shard_rows: int = INGEST_SHARD_ROWS, force: bool = False) -> Progress:
+    writer = DocumentWriter(database_url, method)
+    embedder = None
+    progress = Progress()
+    documents = {"read": 0, "unchanged": 0}
+    # document id -> [chunks not yet written or skipped, chunk count, hash]; finished once the count hits 0
+    pending: Dict[int, list] = {}
+
+    def settle(document_id: int, written: int):
+        pending[document_id][0] -= written
+
+    def finish_settled():
+        for document_id in [d for d, state in pending.items() if state[0] <= 0]:
+            _, count, digest = pending.pop(document_id)
+            writer.finish_document(document_id, count, digest)
+
+    def row_batches():
+        batch: List[Dict] = []
+        for path in iter_paths(root):
+            document = read_document(path, root if root.is_dir() else path, fmt)
+            documents["read"] += 1
+            digest = document_hash(document, model_name, chunk_tokens, overlap_tokens)
+            document_id, stored = writer.begin_document(source, document, language, category)
+            if stored == digest and not force:
+                documents["unchanged"] += 1
+                continue
+            rows = chunk_rows(document, document_id, source, language, category, model_name, count_tokens,
+                              chunk_tokens, overlap_tokens)
+            progress.read += len(rows)
+            pending[document_id] = [len(rows), len(rows), digest]
+            if not force:
+                # A position whose text didn't change keeps its vector; identical text stored under
+                # another position (or document) doesn't count, that row may be about to change
+                stored = writer.stored_hashes([r["source_key"] for r in rows])
+                fresh = [r for r in rows if stored.get(r["source_key"]) != r["content_hash"]]
+                progress.skipped += len(rows) - len(fresh)
+                settle(document_id, len(rows) - len(fresh))
+                rows = fresh
+            batch.extend(rows)
+            if len(batch) >= batch_rows:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    try:
+        writer.prepare()
+        serving = writer.embedding
+        model_name = model_name or serving.model or EMBED_MODEL_NAME
+        if serving.model and serving.model != model_name:
+            raise RuntimeError(f"knowledge_base serves {serving.model} vectors, not {model_name}; "
+                               f"ingest with --model {serving.model}")
+        check_dimension(model_name, writer.column_dimension() or serving.dimension, f"knowledge_base.{serving.column}")
+        if workers > 1:
+            embedder = PoolEmbedder(model_name, batch_size, workers, shard_rows)
+        else:
+            embedder = Embedder(model_name, batch_size)
+        # Chunks past max_seq_length would be silently truncated by the model
+        if embedder.max_seq_length and chunk_tokens > embedder.max_seq_length:
+            logger.info(f"{model_name} reads at most {embedder.max_seq_length} tokens; using that as the chunk size")
+            chunk_tokens = embedder.max_seq_length
+        count_tokens = TokenCounter(model_name)
+
+        batches = embedder.embed(row_batches())
+        while True:
+            started = time.perf_counter()
+            batch = next(batches, None)
+            progress.embed_seconds += time.perf_counter() - started
+            if batch is None:
+                break
+            rows, embeddings = batch
+            started = time.perf_counter()
+            progress.written += writer.write(rows, embeddings, force=force)
+            progress.write_seconds += time.perf_counter() - started
+            for row in rows:
+                settle(row["document_id"], 1)
+            finish_settled()
+            progress.log()
+        # Documents whose chunks were all unchanged
+        finish_settled()
+    finally:
+        if embedder is not None:
+            embedder.close()
+        writer.close()
+    logger.info(f"{documents['read']} documents, {documents['unchanged']} unchanged")
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunk long documents into knowledge_base")
+    parser.add_argument("path", type=Path, help="File or directory of .txt, .md and .html files")
+    parser.add_argument("--source", required=True, help="Value for knowledge_base.source, e.g. icar_manuals")
+    parser.add_argument("--format", choices=sorted(PARSERS), help="Override format detection by extension")
+    parser.add_argument("--language", default="en")
+    parser.add_argument("--category", help="Category for every chunk, e.g. soil_health")
+    parser.add_argument("--chunk-tokens", type=int, default=DOC_CHUNK_TOKENS)
+    parser.add_argument("--overlap-tokens", type=int, default=DOC_CHUNK_OVERLAP)
+    parser.add_argument("--batch-rows", type=int, default=INGEST_CHUNK_ROWS, help="Chunks per embed/write batch")
+    parser.add_argument("--batch-size", type=int, default=INGEST_BATCH_SIZE)
+    parser.add_argument("--method", choices=("copy", "executemany"), default="copy")
+    parser.add_argument("--model", help="Embedding model (default: the one knowledge_base serves, else EMBED_MODEL)")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="Embedding processes (1 = in-process)")
+    parser.add_argument("--shard-rows", type=int, default=INGEST_SHARD_ROWS)
+    parser.add_argument("--force", action="store_true", help="Re-chunk and re-embed unchanged documents")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    progress = ingest_documents(args.path, args.source, args.language, args.category, fmt=args.format,
+                                chunk_tokens=args.chunk_tokens, overlap_tokens=args.overlap_tokens,
+                                batch_rows=args.batch_rows, batch_size=args.batch_size, method=args.method,
+                                model_name=args.model, workers=args.workers, shard_rows=args.shard_rows,
+                                force=args.force)
+    progress.log()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+# llm_pool.py
+# Pool of llama.cpp contexts for answer generation
+#
+# A single Llama behind a lock serialized every generation in the worker, so one long
+# answer held up every other request. LlamaPool keeps up to LLM_POOL_SIZE Llama instances
+# of the same GGUF file instead. Weights are mmapped (use_mmap), so the instances share one
+# copy of the weights in the page cache and each adds only its own KV cache (n_ctx) and
+# scratch buffers. LLM_THREADS cores are split evenly between the contexts.
+#
+# Contexts are created on demand (or all at startup with LLM_POOL_PRELOAD=1). A request
+# waits on an asyncio queue for an idle context; wait times are recorded for stats().
+#
+# A static prompt prefix (system prompt and RAG template head) is evaluated once and its
+# state snapshotted with Llama.save_state(); a context whose KV cache doesn't already
+# start with the prefix gets the snapshot restored with load_state() before a request,
+# and llama-cpp-python's prefix matching then prefills only the rest of the prompt.
+# Prompts are always tokenized whole (see prompt_tokens), so caching never changes the
+# tokens the model sees.
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "2"))
+LLM_N_CTX = int(os.getenv("LLM_N_CTX", "4096"))
+# Cores for generation in this worker, shared by the pool's contexts (0 = all cores)
+LLM_THREADS = int(os.getenv("LLM_THREADS", "0"))
+LLM_POOL_PRELOAD = os.getenv("LLM_POOL_PRELOAD", "0") == "1"
+# Queue waits kept for the percentiles in stats()
+LLM_POOL_WAIT_SAMPLES = 1000
+
+
+def prompt_tokens(llm, prompt: str, prefix_tokens: Sequence[int]) -> Tuple[List[int], bool]:
+    # The whole prompt's tokens, and whether they start with the cached prefix's tokens. The rest
+    # is not tokenized on its own: SentencePiece can add a leading space piece or merge across
+    # the seam, so a cached prefix is only reused when the whole-prompt tokens agree with it.
+    tokens = llm.tokenize(prompt.encode("utf-8"), add_bos=True, special=True)
+    n = len(prefix_tokens)
+    return tokens, bool(n) and len(tokens) > n and tokens[:n] == list(prefix_tokens)
+
+
+class LlamaPool:
+    """Async checkout of llama.cpp contexts sharing one mmapped GGUF file."""
+
+    def __init__(self, model_path: Path, size: int = LLM_POOL_SIZE, n_ctx: int = LLM_N_CTX,
+                 threads: int = LLM_THREADS, prefix: str = ""):
+        self.model_path = Path(model_path)
+        self.prefix = prefix
+        self._prefix_tokens: Optional[List[int]] = None
+        self._prefix_state = None
+        self._prefix_lock = threading.Lock()
+        self.prefix_hits = 0
+        self.prefix_restores = 0
+        self.prefix_mismatches = 0
+        self.size = max(size, 1)
+        self.n_ctx = n_ctx
+        self.threads_per_context = max((threads or os.cpu_count() or 1) // self.size, 1)
+        self._idle: Optional[asyncio.Queue] = None
+        self._created = 0
+        self.waiting = 0
+        self.in_use = 0
+        self.acquisitions = 0
+        self.aborted = 0
+        self.waits = deque(maxlen=LLM_POOL_WAIT_SAMPLES)
+
+    def _queue(self) -> asyncio.Queue:
+        # Created inside the serving event loop
+        if self._idle is None:
+            self._idle = asyncio.Queue()
+        return self._idle
+
+    def _load(self):
+        from llama_cpp import Llama
+
+        logger.info(f"Loading llama.cpp context {self._created}/{self.size} "
+                    f"(n_ctx={self.n_ctx}, {self.threads_per_context} threads)")
+        return Llama(model_path=str(self.model_path), n_ctx=self.n_ctx, n_threads=self.threads_per_context,
+                     use_mmap=True, verbose=False)
+
+    async def _load_slot(self):
+        # Reserves a slot before awaiting, so concurrent requests don't overshoot the size, and loads
+        # a context into it. A caller cancelled mid-load (client disconnect) doesn't lose the slot:
+        # the load finishes in the threadpool and its context goes to the idle queue.
+        self._created += 1
+        future = asyncio.ensure_future(run_in_threadpool(self._load))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(self._adopt)
+            raise
+        except BaseException:
+            self._created -= 1
+            raise
+
+    def _adopt(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            self._created -= 1
+        else:
+            self._queue().put_nowait(future.result())
+
+    async def warm(self):
+        # Load every context up front instead of on first demand
+        while self._created < self.size:
+            self._queue().put_nowait(await self._load_slot())
+
+    async def _checkout(self):
+        idle = self._queue()
+        if idle.empty() and self._created < self.size:
+            return await self._load_slot()
+        return await idle.get()
+
+    def _checkin(self, llm):
+        self.in_use -= 1
+        self._queue().put_nowait(llm)
+
+    async def _acquire(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            llm = await self._checkout()
+        finally:
+            self.waiting -= 1
+        self.waits.append(time.perf_counter() - started)
+        self.acquisitions += 1
+        self.in_use += 1
+        return llm
+
+    @asynccontextmanager
+    async def acquire(self):
+        # For callers that only use the context from the event loop thread
+        llm = await self._acquire()
+        try:
+            yield llm
+        finally:
+            self._checkin(llm)
+
+    async def run(self, fn: Callable, *args, **kwargs):
+        # Runs fn(llm, *args, **kwargs) in the threadpool. The context goes back to the pool when
+        # fn returns, not when the caller stops waiting: a cancelled request can't hand a context
+        # that is still generating to the next one.
+        llm = await self._acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(None, functools.partial(fn, llm, *args, **kwargs))
+        except BaseException:
+            self._checkin(llm)
+            raise
+        future.add_done_callback(lambda _: self._checkin(llm))
+        return await asyncio.shield(future)
+
+    def _with_prefix(self, llm, prompt: str):
+        # Threadpool side: leaves the static prefix in llm's KV cache and returns the prompt as tokens
+        # (or the prompt unchanged when it doesn't start with the prefix)
+        if not self.prefix or not prompt.startswith(self.prefix):
+            return prompt
+        with self._prefix_lock:
+            if self._prefix_tokens is None:
+                self._prefix_tokens = llm.tokenize(self.prefix.encode("utf-8"), add_bos=True, special=True)
+            if self._prefix_state is None:
+                llm.reset()
+                llm.eval(self._prefix_tokens)
+                self._prefix_state = llm.save_state()
+                logger.info(f"Cached {len(self._prefix_tokens)}-token prompt prefix "
+                            f"({self._prefix_state.llama_state_size / 2**20:.1f} MiB state)")
+        tokens, shared = prompt_tokens(llm, prompt, self._prefix_tokens)
+        if not shared:
+            # Tokenized differently across the seam: plain prefill, whatever the context holds
+            self.prefix_mismatches += 1
+            return tokens
+        n = len(self._prefix_tokens)
+        # input_ids[:n_tokens]: tokens currently in the context's KV cache
+        if list(llm.input_ids[:min(llm.n_tokens, n)]) == self._prefix_tokens:
+            self.prefix_hits += 1
+        else:
+            llm.load_state(self._prefix_state)
+            self.prefix_restores += 1
+        return tokens
+
+    async def stream(self, prompt: str, **kwargs) -> AsyncIterator[str]:
+        # Text deltas of llm.create_completion(prompt, stream=True, **kwargs) as llama.cpp produces them.
+        # The completion runs in the threadpool; when the consumer stops early the thread stops at
+        # the next token and the context goes back to the pool once it has.
+        llm = await self._acquire()
+        loop = asyncio.get_running_loop()
+        deltas: asyncio.Queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for chunk in llm.create_completion(self._with_prefix(llm, prompt), stream=True, **kwargs):
+                    if stop.is_set():
+                        break
+                    text = chunk["choices"][0]["text"]
+                    if text:
+                        loop.call_soon_threadsafe(deltas.put_nowait, text)
+                loop.call_soon_threadsafe(deltas.put_nowait, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(deltas.put_nowait, e)
+
+        try:
+            future = loop.run_in_executor(None, produce)
+        except BaseException:
+            self._checkin(llm)
+            raise
+        future.add_done_callback(lambda _: self._checkin(llm))
+        done = False
+        try:
+            while True:
+                item = await deltas.get()
+                if item is None:
+                    done = True
+                    return
+                if isinstance(item, Exception):
+                    done = True
+                    raise item
+                yield item
+        finally:
+            if not done:
+                # Consumer went away mid-answer (client disconnect)
+                self.aborted += 1
+            stop.set()
+
+    def stats(self) -> dict:
+        waits = np.array(self.waits) * 1000 if self.waits else np.zeros(1)
+        return {
+            "size": self.size,
+            "loaded": self._created,
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquisitions": self.acquisitions,
+            "aborted": self.aborted,
+            "prefix_tokens": len(self._prefix_tokens or []),
+            "prefix_hits": self.prefix_hits,
+            "prefix_restores": self.prefix_restores,
+            "prefix_mismatches": self.prefix_mismatches,
+            "wait_p50_ms": float(np.percentile(waits, 50)),
+            "wait_p95_ms": float(np.percentile(waits, 95)),
+            "wait_max_ms": float(waits.max()),
+        }
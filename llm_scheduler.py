@@ -0,0 +1,402 @@
+# llm_scheduler.py
+# Continuous-batching generation over one llama.cpp context (LLM_ENGINE=continuous)
+#
+# With one request per context (llm_pool.py) every decode step multiplies a single token's
+# activations through the whole weight matrix, so the CPU is bound by memory bandwidth
+# and mostly idle. GenerationScheduler keeps up to LLM_BATCH_SEQUENCES requests in flight
+# as separate sequences of one context and, at every step, decodes one token of each of
+# them in a single llama_decode batch; prompt prefill of newly admitted requests rides in
+# the same batch, chunked to LLM_BATCH_TOKENS tokens per step. Requests are admitted
+# between steps as soon as a sequence slot frees up, so a long answer never holds up
+# a short one.
+#
+# The loop runs on its own thread; each request gets an asyncio queue of text deltas
+# (stream()). Sampling (temperature / top-p) is done on the logits in numpy.
+#
+# A static prompt prefix (system prompt and RAG template head) is evaluated once into a
+# reserved sequence at load time; every request whose prompt starts with it gets those
+# KV cells copied into its own sequence (seq_cp shares the cells, no recompute), so
+# prefill only covers the retrieved contexts and the question.
+#
+# This drives llama.cpp through the low-level llama_cpp bindings (batch API and KV cache
+# sequence operations), whose names changed across llama-cpp-python releases; _kv_seq_rm,
+# _kv_seq_cp and _new_context cover the variants.
+import asyncio
+import codecs
+import logging
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from llm_pool import LLM_N_CTX, LLM_THREADS, prompt_tokens
+
+logger = logging.getLogger(__name__)
+
+# Concurrent sequences in the shared context, and the token budget of one decode step
+LLM_BATCH_SEQUENCES = int(os.getenv("LLM_BATCH_SEQUENCES", "8"))
+LLM_BATCH_TOKENS = int(os.getenv("LLM_BATCH_TOKENS", "512"))
+LLM_TOP_P = float(os.getenv("LLM_TOP_P", "0.95"))
+
+
+def _kv_seq_rm(llama_cpp, ctx, seq_id: int):
+    # Drops a finished sequence's KV cells so its slot can be reused
+    if hasattr(llama_cpp, "llama_memory_seq_rm"):
+        llama_cpp.llama_memory_seq_rm(llama_cpp.llama_get_memory(ctx), seq_id, -1, -1)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+        llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+    else:
+        llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+
+
+def _kv_seq_cp(llama_cpp, ctx, src: int, dst: int, end: int):
+    # Makes positions [0, end) of src visible to dst as well
+    if hasattr(llama_cpp, "llama_memory_seq_cp"):
+        llama_cpp.llama_memory_seq_cp(llama_cpp.llama_get_memory(ctx), src, dst, 0, end)
+    elif hasattr(llama_cpp, "llama_kv_self_seq_cp"):
+        llama_cpp.llama_kv_self_seq_cp(ctx, src, dst, 0, end)
+    else:
+        llama_cpp.llama_kv_cache_seq_cp(ctx, src, dst, 0, end)
+
+
+def _new_context(llama_cpp, model, params):
+    if hasattr(llama_cpp, "llama_init_from_model"):
+        return llama_cpp.llama_init_from_model(model, params)
+    return llama_cpp.llama_new_context_with_model(model, params)
+
+
+def sample(logits: np.ndarray, temperature: float, top_p: float, rng: np.random.Generator) -> int:
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    scaled = logits.astype(np.float64) / temperature
+    probs = np.exp(scaled - scaled.max())
+    probs /= probs.sum()
+    if top_p < 1.0:
+        order = np.argsort(-probs)
+        keep = order[:int(np.searchsorted(np.cumsum(probs[order]), top_p)) + 1]
+        kept = probs[keep] / probs[keep].sum()
+        return int(keep[rng.choice(len(keep), p=kept)])
+    return int(rng.choice(len(probs), p=probs))
+
+
+class GenerationRequest:
+    """One prompt in flight: its sequence state and the queue its text deltas go to."""
+
+    def __init__(self, tokens: List[int], max_tokens: int, temperature: float, stop: Sequence[str],
+                 loop: asyncio.AbstractEventLoop):
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.stop = list(stop)
+        self.loop = loop
+        self.deltas: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+        self.seq_id: Optional[int] = None
+        self.prefilled = 0       # prompt tokens already in the KV cache
+        self.position = 0        # next position in the sequence
+        self.next_token: Optional[int] = None
+        self.generated = 0
+        self.text = ""
+        self.emitted = 0
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.submitted = time.perf_counter()
+        self.admitted: Optional[float] = None
+        self.first_token: Optional[float] = None
+
+    def push(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.deltas.put_nowait, item)
+        except RuntimeError:
+            # Event loop already closed (shutdown); nobody is listening
+            self.cancelled = True
+
+    def append(self, piece: bytes) -> bool:
+        # Adds a token's bytes; returns True when a stop string was produced. The tail that could
+        # still become a stop string is held back until the next token.
+        self.text += self._decoder.decode(piece)
+        for stop in self.stop:
+            found = self.text.find(stop, max(self.emitted - len(stop), 0))
+            if found != -1:
+                self.text = self.text[:found]
+                return True
+        holdback = max((len(s) - 1 for s in self.stop), default=0)
+        end = max(len(self.text) - holdback, self.emitted)
+        if end > self.emitted:
+            self.push(self.text[self.emitted:end])
+            self.emitted = end
+        return False
+
+    def finish(self, error: Optional[BaseException] = None):
+        if error is None and len(self.text) > self.emitted:
+            self.push(self.text[self.emitted:])
+            self.emitted = len(self.text)
+        self.push(error)
+
+
+class GenerationScheduler:
+    """Interleaves decode steps of many requests in shared llama.cpp batches."""
+
+    def __init__(self, model_path: Path, sequences: int = LLM_BATCH_SEQUENCES, n_ctx: int = LLM_N_CTX,
+                 batch_tokens: int = LLM_BATCH_TOKENS, threads: int = LLM_THREADS, top_p: float = LLM_TOP_P,
+                 prefix: str = ""):
+        self.model_path = Path(model_path)
+        self.prefix = prefix
+        self.prefix_tokens: List[int] = []
+        self.sequences = max(sequences, 1)
+        self.n_ctx = n_ctx              # per sequence
+        self.batch_tokens = max(batch_tokens, self.sequences)
+        self.threads = threads or os.cpu_count() or 1
+        self.top_p = top_p
+        self._pending: deque = deque()
+        self._active: Dict[int, GenerationRequest] = {}
+        self._wakeup = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._ready = threading.Event()
+        self._load_error: Optional[BaseException] = None
+        self.llm = None
+        self.rng = np.random.default_rng()
+        self.steps = 0
+        self.batched_sequences = 0
+        self.tokens_generated = 0
+        self.requests_finished = 0
+        self.requests_cancelled = 0
+        self.prefix_tokens_reused = 0
+        self.prefix_mismatches = 0
+        self.decode_seconds = 0.0
+        self.queue_waits = deque(maxlen=1000)
+        self.first_token_waits = deque(maxlen=1000)
+
+    # -- public, event loop side ----------------------------------------------
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="llm-scheduler", daemon=True)
+            self._thread.start()
+
+    async def stream(self, prompt: str, max_tokens: int, temperature: float = 0.0,
+                     stop: Sequence[str] = ()) -> AsyncIterator[str]:
+        # Text deltas of the completion as they are sampled
+        self.start()
+        await asyncio.get_running_loop().run_in_executor(None, self._ready.wait)
+        if self._load_error is not None:
+            raise RuntimeError(f"LLM failed to load: {self._load_error}")
+        # Tokenized whole; _share_prefix reuses the cached prefix only if these tokens start with it
+        tokens, shared = prompt_tokens(self.llm, prompt, self.prefix_tokens)
+        if self.prefix_tokens and not shared and prompt.startswith(self.prefix):
+            self.prefix_mismatches += 1
+        if len(tokens) >= self.n_ctx:
+            raise ValueError(f"Prompt of {len(tokens)} tokens doesn't fit the {self.n_ctx}-token context")
+        request = GenerationRequest(tokens, min(max_tokens, self.n_ctx - len(tokens)), temperature, stop,
+                                    asyncio.get_running_loop())
+        with self._wakeup:
+            self._pending.append(request)
+            self._wakeup.notify()
+        try:
+            while True:
+                item = await request.deltas.get()
+                if item is None:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            # Consumer gone (finished, failed or cancelled): the loop frees the sequence at its next step
+            request.cancelled = True
+
+    async def complete(self, prompt: str, max_tokens: int, temperature: float = 0.0, stop: Sequence[str] = ()) -> str:
+        return "".join([delta async for delta in self.stream(prompt, max_tokens, temperature, stop)])
+
+    def stats(self) -> dict:
+        def percentile(samples, q):
+            return float(np.percentile(np.array(samples) * 1000, q)) if samples else 0.0
+
+        return {
+            "sequences": self.sequences,
+            "active": len(self._active),
+            "queued": len(self._pending),
+            "steps": self.steps,
+            "mean_batch_sequences": self.batched_sequences / self.steps if self.steps else 0.0,
+            "tokens_generated": self.tokens_generated,
+            "tokens_per_second": self.tokens_generated / self.decode_seconds if self.decode_seconds else 0.0,
+            "requests_finished": self.requests_finished,
+            "requests_cancelled": self.requests_cancelled,
+            "queue_wait_p50_ms": percentile(self.queue_waits, 50),
+            "queue_wait_p95_ms": percentile(self.queue_waits, 95),
+            "first_token_p50_ms": percentile(self.first_token_waits, 50),
+            "first_token_p95_ms": percentile(self.first_token_waits, 95),
+            "prefix_tokens": len(self.prefix_tokens),
+            "prefix_tokens_reused": self.prefix_tokens_reused,
+            "prefix_mismatches": self.prefix_mismatches,
+        }
+
+    # -- scheduler thread -----------------------------------------------------
+
+    def _load(self):
+        import llama_cpp
+        from llama_cpp import Llama
+
+        # Llama supplies the mmapped model, tokenizer and default params; generation runs in a
+        # context of our own sized for all sequences (the Llama's own context stays minimal)
+        self.llm = Llama(model_path=str(self.model_path), n_ctx=256, n_threads=self.threads, use_mmap=True,
+                         verbose=False)
+        if self.prefix:
+            self.prefix_tokens = self.llm.tokenize(self.prefix.encode("utf-8"), add_bos=True, special=True)
+        # One extra sequence holds the prefix
+        seqs = self.sequences + (1 if self.prefix_tokens else 0)
+        params = self.llm.context_params
+        params.n_ctx = self.n_ctx * seqs
+        params.n_batch = self.batch_tokens
+        if hasattr(params, "n_ubatch"):
+            params.n_ubatch = self.batch_tokens
+        params.n_seq_max = seqs
+        params.n_threads = self.threads
+        params.n_threads_batch = self.threads
+        self.llama_cpp = llama_cpp
+        self.ctx = _new_context(llama_cpp, self.llm._model.model, params)
+        if not self.ctx:
+            raise RuntimeError("llama.cpp could not create the batched context")
+        self.batch = llama_cpp.llama_batch_init(self.batch_tokens, 0, 1)
+        self.n_vocab = self.llm.n_vocab()
+        self.end_tokens = {self.llm.token_eos()}
+        # Phi-3 ends turns with <|end|>, which isn't its EOS token
+        self.end_tokens.update(self.llm.tokenize(b"<|end|>", add_bos=False, special=True)[-1:])
+        if self.prefix_tokens:
+            self._eval_prefix()
+        logger.info(f"Continuous batching: {self.sequences} sequences x {self.n_ctx} tokens, "
+                    f"{self.batch_tokens} tokens/step, {self.threads} threads, "
+                    f"{len(self.prefix_tokens)} prefix tokens cached")
+
+    @property
+    def prefix_seq(self) -> int:
+        return self.sequences
+
+    def _eval_prefix(self):
+        # Prefill of the static prefix, once, into its reserved sequence (no logits needed)
+        batch = self.batch
+        for start in range(0, len(self.prefix_tokens), self.batch_tokens):
+            chunk = self.prefix_tokens[start:start + self.batch_tokens]
+            for i, token in enumerate(chunk):
+                batch.token[i] = token
+                batch.pos[i] = start + i
+                batch.n_seq_id[i] = 1
+                batch.seq_id[i][0] = self.prefix_seq
+                batch.logits[i] = False
+            batch.n_tokens = len(chunk)
+            status = self.llama_cpp.llama_decode(self.ctx, batch)
+            if status != 0:
+                raise RuntimeError(f"llama_decode of the prompt prefix failed with status {status}")
+
+    def _share_prefix(self, request: GenerationRequest):
+        # Starts the request's sequence from the cached prefix when its prompt begins with it
+        n = len(self.prefix_tokens)
+        if n and len(request.tokens) > n and request.tokens[:n] == self.prefix_tokens:
+            _kv_seq_cp(self.llama_cpp, self.ctx, self.prefix_seq, request.seq_id, n)
+            request.prefilled = request.position = n
+            self.prefix_tokens_reused += n
+
+    def _run(self):
+        try:
+            self._load()
+        except BaseException as e:
+            logger.error(f"Loading {self.model_path} failed: {str(e)}")
+            self._load_error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        free_slots = list(range(self.sequences))
+        while True:
+            with self._wakeup:
+                while not self._pending and not self._active:
+                    self._wakeup.wait()
+                # Admit new requests between steps while sequence slots are free
+                while self._pending and free_slots:
+                    request = self._pending.popleft()
+                    if request.cancelled:
+                        self.requests_cancelled += 1
+                        continue
+                    request.seq_id = free_slots.pop()
+                    request.admitted = time.perf_counter()
+                    self.queue_waits.append(request.admitted - request.submitted)
+                    self._share_prefix(request)
+                    self._active[request.seq_id] = request
+            # Consumers that went away (client disconnects) stop generating and free their slot
+            for request in [r for r in self._active.values() if r.cancelled]:
+                self.requests_cancelled += 1
+                self._release(request, free_slots, cancelled=True)
+            if self._active:
+                self._step(free_slots)
+
+    def _release(self, request: GenerationRequest, free_slots: List[int], error: Optional[BaseException] = None,
+                 cancelled: bool = False):
+        # A cancelled request is counted in requests_cancelled only
+        _kv_seq_rm(self.llama_cpp, self.ctx, request.seq_id)
+        del self._active[request.seq_id]
+        free_slots.append(request.seq_id)
+        if not cancelled:
+            self.requests_finished += 1
+        request.finish(error)
+
+    def _step(self, free_slots: List[int]):
+        batch = self.batch
+        n = 0
+        logits_at: Dict[int, GenerationRequest] = {}
+        in_batch: Dict[int, GenerationRequest] = {}
+
+        def add(token: int, request: GenerationRequest, logits: bool):
+            nonlocal n
+            batch.token[n] = token
+            batch.pos[n] = request.position
+            batch.n_seq_id[n] = 1
+            batch.seq_id[n][0] = request.seq_id
+            batch.logits[n] = logits
+            if logits:
+                logits_at[n] = request
+            in_batch[request.seq_id] = request
+            request.position += 1
+            n += 1
+
+        # One token for every decoding sequence first, then prompt chunks with the remaining budget
+        for request in self._active.values():
+            if request.next_token is not None:
+                add(request.next_token, request, True)
+        for request in self._active.values():
+            while request.prefilled < len(request.tokens) and n < self.batch_tokens:
+                last = request.prefilled == len(request.tokens) - 1
+                add(request.tokens[request.prefilled], request, last)
+                request.prefilled += 1
+        if n == 0:
+            return
+        batch.n_tokens = n
+
+        started = time.perf_counter()
+        status = self.llama_cpp.llama_decode(self.ctx, batch)
+        self.decode_seconds += time.perf_counter() - started
+        if status != 0:
+            # KV cache full (or a decode failure): fail this step's requests rather than the worker
+            error = RuntimeError(f"llama_decode failed with status {status}")
+            for request in in_batch.values():
+                self._release(request, free_slots, error)
+            return
+        self.steps += 1
+        self.batched_sequences += len(logits_at)
+
+        for i, request in logits_at.items():
+            logits = np.ctypeslib.as_array(self.llama_cpp.llama_get_logits_ith(self.ctx, i), shape=(self.n_vocab,))
+            token = sample(logits, request.temperature, self.top_p, self.rng)
+            request.generated += 1
+            self.tokens_generated += 1
+            if request.first_token is None:
+                request.first_token = time.perf_counter()
+                self.first_token_waits.append(request.first_token - request.submitted)
+            if token in self.end_tokens:
+                self._release(request, free_slots)
+                continue
+            stopped = request.append(self.llm.detokenize([token]))
+            if stopped or request.generated >= request.max_tokens or request.position >= self.n_ctx:
+                self._release(request, free_slots)
+                continue
+            request.next_token = token
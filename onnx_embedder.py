@@ -0,0 +1,293 @@
+# onnx_embedder.py
+# Optional ONNX Runtime backend for the sentence embedding model (EMBED_BACKEND=onnx)
+#
+# export traces the whole SentenceTransformer (transformer, pooling, dense layers and any
+# normalization module) into one ONNX graph, so the pooled sentence embedding comes out
+# of the graph exactly as model.encode computes it, and writes an int8 copy with dynamic
+# quantization of the weights:
+#   artifacts/onnx/<model tag>/
+#     model.onnx          float32 graph
+#     model.int8.onnx     dynamically quantized (int8 weights, activations quantized per batch)
+#     config.json         model name, dimension, max_seq_length, graph inputs
+#     tokenizer files
+#
+# With EMBED_BACKEND=onnx, embedding_models.load_model returns an OnnxEmbedder instead of
+# a SentenceTransformer; it has the same encode() / get_sentence_embedding_dimension() /
+# max_seq_length surface, so the app, ingest.py and reembed.py use it unchanged. Vectors
+# are close to, not bit-identical with, the PyTorch ones (see report), so the knowledge
+# base and queries may be embedded by different backends of the same model.
+#
+# Usage (run separately, needs torch, onnx and onnxruntime):
+#   python onnx_embedder.py export sentence-transformers/distiluse-base-multilingual-cased-v1
+#   python onnx_embedder.py report sentence-transformers/distiluse-base-multilingual-cased-v1 --store artifacts/qa_store
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+
+from embedding_models import EMBED_MODEL_NAME, check_dimension
+
+logger = logging.getLogger(__name__)
+
+ONNX_DIR = Path(os.getenv("EMBED_ONNX_DIR", "artifacts/onnx"))
+# Serve the int8 graph (1) or the float32 one (0)
+EMBED_ONNX_QUANTIZED = os.getenv("EMBED_ONNX_QUANTIZED", "1") == "1"
+# ONNX Runtime intra-op threads (0 = one per core); ingest.py pool workers set their share
+EMBED_ONNX_THREADS = int(os.getenv("EMBED_ONNX_THREADS", "0"))
+ONNX_OPSET = 14
+
+FP32_FILENAME = "model.onnx"
+INT8_FILENAME = "model.int8.onnx"
+CONFIG_FILENAME = "config.json"
+# Inputs a SentenceTransformer tokenizer may produce, in graph argument order
+GRAPH_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def model_dir(model_name: str, onnx_dir: Path = ONNX_DIR) -> Path:
+    tag = model_name.rsplit("/", 1)[-1]
+    return Path(onnx_dir) / f"{tag}-{hashlib.sha1(model_name.encode('utf-8')).hexdigest()[:8]}"
+
+
+def export(model_name: str, onnx_dir: Path = ONNX_DIR, quantize: bool = True, per_channel: bool = False) -> Path:
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device="cpu")
+    model.eval()
+    out = model_dir(model_name, onnx_dir)
+    out.mkdir(parents=True, exist_ok=True)
+
+    sample = model.tokenize(["How often should I water my tomato plants?", "When to sow wheat"])
+    inputs = [name for name in GRAPH_INPUTS if name in sample]
+
+    class SentenceEmbeddingGraph(torch.nn.Module):
+        # Positional tensors -> the features dict SentenceTransformer.forward expects
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *tensors):
+            return self.model(dict(zip(inputs, tensors)))["sentence_embedding"]
+
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in inputs}
+    dynamic_axes["sentence_embedding"] = {0: "batch"}
+    fp32_path = out / FP32_FILENAME
+    with torch.no_grad():
+        torch.onnx.export(SentenceEmbeddingGraph(), tuple(sample[name] for name in inputs), str(fp32_path),
+                          input_names=inputs, output_names=["sentence_embedding"], dynamic_axes=dynamic_axes,
+                          opset_version=ONNX_OPSET, do_constant_folding=True)
+    logger.info(f"Exported {model_name} to {fp32_path} ({fp32_path.stat().st_size / 2**20:.0f} MiB)")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = out / INT8_FILENAME
+        quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8, per_channel=per_channel)
+        logger.info(f"Quantized to {int8_path} ({int8_path.stat().st_size / 2**20:.0f} MiB)")
+
+    model.tokenizer.save_pretrained(str(out))
+    first = model[0]
+    config = {
+        "model": model_name,
+        "dimension": model.get_sentence_embedding_dimension(),
+        "max_seq_length": model.max_seq_length,
+        "do_lower_case": bool(getattr(first, "do_lower_case", False)),
+        "inputs": inputs,
+    }
+    with open(out / CONFIG_FILENAME, "w") as f:
+        json.dump(config, f, indent=2)
+    return out
+
+
+class OnnxEmbedder:
+    """SentenceTransformer.encode work-alike running an exported graph under ONNX Runtime."""
+
+    def __init__(self, directory: Path, quantized: bool = EMBED_ONNX_QUANTIZED, threads: Optional[int] = None):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.directory = Path(directory)
+        with open(self.directory / CONFIG_FILENAME) as f:
+            self.config = json.load(f)
+        path = self.directory / (INT8_FILENAME if quantized else FP32_FILENAME)
+        if not path.exists():
+            raise FileNotFoundError(f"{path} not found; run `python onnx_embedder.py export {self.config['model']}`")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        threads = EMBED_ONNX_THREADS if threads is None else threads
+        if threads > 0:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.directory))
+        self.model_name = self.config["model"]
+        self.max_seq_length = self.config["max_seq_length"]
+        self.path = path
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config["dimension"]
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32, convert_to_numpy: bool = True,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        # Same arguments as SentenceTransformer.encode (progress bars etc. are accepted and ignored)
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        vectors = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        # Longest first, like SentenceTransformer, so each batch pads to similar lengths
+        order = np.argsort([-len(t) for t in texts], kind="stable")
+        for start in range(0, len(texts), max(batch_size, 1)):
+            positions = order[start:start + batch_size]
+            batch = [texts[i] for i in positions]
+            if self.config.get("do_lower_case"):
+                batch = [t.lower() for t in batch]
+            encoded = self.tokenizer(batch, padding=True, truncation=True, max_length=self.max_seq_length,
+                                     return_tensors="np")
+            feeds = {name: encoded[name].astype(np.int64) for name in self.config["inputs"]}
+            vectors[positions] = self.session.run(None, feeds)[0]
+        if normalize_embeddings:
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[0] if single else vectors
+
+
+def load_onnx_model(model_name: str, quantized: bool = EMBED_ONNX_QUANTIZED) -> OnnxEmbedder:
+    directory = model_dir(model_name)
+    if not (directory / CONFIG_FILENAME).exists():
+        raise FileNotFoundError(f"No ONNX export of {model_name} in {directory}; "
+                                f"run `python onnx_embedder.py export {model_name}` or set EMBED_BACKEND=torch")
+    model = OnnxEmbedder(directory, quantized)
+    check_dimension(model_name, model.get_sentence_embedding_dimension(), f"{model.path}")
+    return model
+
+
+# -- accuracy / latency report ----------------------------------------------
+
+def _latency(model, texts: List[str], batch_size: int) -> Dict[str, float]:
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    single = []
+    for value in texts[:200]:
+        started = time.perf_counter()
+        model.encode([value], batch_size=1)
+        single.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    model.encode(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": float(np.percentile(single, 50) * 1000),
+        "p95_ms": float(np.percentile(single, 95) * 1000),
+        "batch_texts_per_second": len(texts) / elapsed,
+    }
+
+
+def _neighbour_recall(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    # Do the texts' nearest neighbours (among themselves) stay the same under the candidate vectors?
+    def top_k(vectors):
+        unit = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        scores = unit @ unit.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+    expected, found = top_k(reference), top_k(candidate)
+    return float(np.mean([len(set(e) & set(f)) / k for e, f in zip(expected, found)]))
+
+
+def report(model_name: str, texts: List[str], batch_size: int = 32, k: int = 10, onnx_dir: Path = ONNX_DIR) -> dict:
+    from sentence_transformers import SentenceTransformer
+
+    reference_model = SentenceTransformer(model_name, device="cpu")
+    reference = reference_model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+    result = {"model": model_name, "texts": len(texts), "k": k,
+              "backends": {"torch_fp32": dict(_latency(reference_model, texts, batch_size), mib=None)}}
+    directory = model_dir(model_name, onnx_dir)
+    for name, quantized in (("onnx_fp32", False), ("onnx_int8", True)):
+        try:
+            model = OnnxEmbedder(directory, quantized)
+        except FileNotFoundError as e:
+            logger.warning(f"Skipping {name}: {str(e)}")
+            continue
+        vectors = model.encode(texts, batch_size=batch_size)
+        cosine = np.sum(reference * vectors, axis=1) / np.maximum(
+            np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1), 1e-12)
+        result["backends"][name] = dict(
+            _latency(model, texts, batch_size),
+            mib=model.path.stat().st_size / 2**20,
+            cosine_mean=float(cosine.mean()),
+            cosine_min=float(cosine.min()),
+            neighbour_recall=_neighbour_recall(reference, vectors, k),
+        )
+    return result
+
+
+def format_report(result: dict) -> str:
+    lines = [f"Embedding backends for {result['model']} ({result['texts']} texts)"]
+    for name, stats in result["backends"].items():
+        line = (f"  {name:<11} p50 {stats['p50_ms']:6.1f} ms  p95 {stats['p95_ms']:6.1f} ms  "
+                f"{stats['batch_texts_per_second']:7.0f} texts/s")
+        if stats.get("mib"):
+            line += f"  {stats['mib']:5.0f} MiB"
+        if "cosine_mean" in stats:
+            line += (f"  cosine vs torch {stats['cosine_mean']:.4f} (min {stats['cosine_min']:.4f})"
+                     f"  neighbour recall@{result['k']} {stats['neighbour_recall']:.3f}")
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def _report_texts(args) -> List[str]:
+    if args.texts:
+        with open(args.texts, encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    elif args.store:
+        from kb_store import KBStore
+
+        store = KBStore(args.store)
+        texts = [store.questions[i] for i in range(min(len(store), args.limit))]
+        store.close()
+    else:
+        from setup_artifacts import agriculture_qa
+
+        texts = [row["question"] for row in agriculture_qa]
+    return texts[:args.limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX Runtime (int8) sentence embedding backend")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = sub.add_parser("export", help="Export the model to ONNX and quantize it to int8")
+    export_parser.add_argument("model", nargs="?", default=EMBED_MODEL_NAME)
+    export_parser.add_argument("--no-quantize", action="store_true")
+    export_parser.add_argument("--per-channel", action="store_true", help="Per-channel weight scales (slower export)")
+    export_parser.add_argument("--onnx-dir", type=Path, default=ONNX_DIR)
+
+    report_parser = sub.add_parser("report", help="Accuracy and latency of torch fp32 vs ONNX fp32 vs ONNX int8")
+    report_parser.add_argument("model", nargs="?", default=EMBED_MODEL_NAME)
+    source = report_parser.add_mutually_exclusive_group()
+    source.add_argument("--texts", type=Path, help="One text per line")
+    source.add_argument("--store", type=Path, help="Use the questions of a KB store directory")
+    report_parser.add_argument("--limit", type=int, default=2000)
+    report_parser.add_argument("--batch-size", type=int, default=32)
+    report_parser.add_argument("--k", type=int, default=10)
+    report_parser.add_argument("--output", type=Path, help="Also write the report as JSON")
+    report_parser.add_argument("--onnx-dir", type=Path, default=ONNX_DIR)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "export":
+        print(export(args.model, args.onnx_dir, quantize=not args.no_quantize, per_channel=args.per_channel))
+    else:
+        result = report(args.model, _report_texts(args), args.batch_size, args.k, args.onnx_dir)
+        print(format_report(result))
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
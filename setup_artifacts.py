@@ -1,7 +1,27 @@
-import pickle
-import numpy as np
-import faiss
-from sentence_transformers import SentenceTransformer
+# setup_artifacts.py
+# Builds the retrieval snapshot (FAISS index + columnar store) from the demo Q&A set or a file
+#
+#   python setup_artifacts.py                                   demo set below
+#   python setup_artifacts.py --input agronomy.parquet --workers 8
+#   python setup_artifacts.py --input agronomy.parquet --shard 0/4   (x4, one per machine/process)
+#
+# Builds are chunked and checkpointed under artifacts/builds/ (see artifact_build.py): after a
+# crash, re-running the same command resumes instead of starting over.
+#
+# The snapshot records EMBED_MODEL; app workers embed queries with the model of the
+# snapshot they serve, so publishing a snapshot built with a new model switches both.
+import argparse
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+from artifact_build import BUILD_CHUNK_ROWS, ArtifactBuild
+from embedding_models import EMBED_MODEL_NAME
+from index_build import FAISS_INDEX_TYPE
+from ingest import ColumnMapping, Embedder, PoolEmbedder, detect_format, read_chunks
+from kb_store import HASH_COLUMN, KBStore
+from snapshots import resolve_snapshot
 
 # Mock agriculture Q&A data (same as in agriculture-data.ts)
 agriculture_qa = [
@@ -57,32 +77,66 @@ agriculture_qa = [
     }
 ]
 
-# Extract questions and answers
-questions = [item["question"] for item in agriculture_qa]
-answers = [item["answer"] for item in agriculture_qa]
+ARTIFACTS_DIR = "artifacts"
+
+
+def previous_vectors(artifacts_dir: str) -> dict:
+    # Vectors of rows whose content hash is unchanged are copied from the published snapshot;
+    # only new or edited rows are encoded
+    store_dir = resolve_snapshot(artifacts_dir) / "qa_store"
+    if not KBStore.exists(store_dir):
+        return {}
+    store = KBStore(store_dir)
+    if HASH_COLUMN not in store.columns:
+        return {}
+    return {h: store.embeddings[i] for i, h in enumerate(store.columns[HASH_COLUMN])}
 
-# Save meta data
-meta = {
-    "questions": questions,
-    "answers": answers
-}
 
-with open("artifacts/qa_meta.pkl", "wb") as f:
-    pickle.dump(meta, f)
+def main():
+    parser = argparse.ArgumentParser(description="Build and publish the retrieval snapshot")
+    parser.add_argument("--input", type=Path, help="CSV, JSONL or Parquet Q&A file (default: built-in demo set)")
+    parser.add_argument("--format", choices=("csv", "jsonl", "parquet"))
+    parser.add_argument("--chunk-rows", type=int, default=BUILD_CHUNK_ROWS)
+    parser.add_argument("--workers", type=int, default=1, help="Embedding processes")
+    parser.add_argument("--shard", default="0/1", help="k/N: embed every N-th chunk starting at k")
+    parser.add_argument("--build-id", help="Resume/share a specific build (default: derived from input and settings)")
+    parser.add_argument("--index-type", default=FAISS_INDEX_TYPE, choices=("flat", "ivfpq", "opq_ivfpq"))
+    parser.add_argument("--no-report", action="store_true", help="Skip the recall/memory report")
+    parser.add_argument("--keep-build", action="store_true", help="Keep chunk checkpoints after publishing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
 
-# Create embeddings
-embed_model = SentenceTransformer("all-MiniLM-L6-v2")
-embeddings = embed_model.encode(questions, convert_to_numpy=True)
+    shard, num_shards = (int(x) for x in args.shard.split("/"))
+    mapping = ColumnMapping()
+    if args.input:
+        fmt = args.format or detect_format(args.input)
+        stat = args.input.stat()
+        source = {"input": str(args.input.resolve()), "size": stat.st_size, "mtime": int(stat.st_mtime)}
+        records = read_chunks(args.input, fmt, args.chunk_rows)
+    else:
+        digest = hashlib.sha256(json.dumps(agriculture_qa, sort_keys=True).encode("utf-8")).hexdigest()
+        source = {"input": "demo", "sha256": digest}
+        records = (agriculture_qa[i:i + args.chunk_rows] for i in range(0, len(agriculture_qa), args.chunk_rows))
+    settings = {**source, "model": EMBED_MODEL_NAME, "chunk_rows": args.chunk_rows, "index_type": args.index_type}
 
-# Normalize embeddings
-faiss.normalize_L2(embeddings)
+    build = ArtifactBuild(ARTIFACTS_DIR, settings, args.build_id)
+    if args.workers > 1:
+        embedder_factory = lambda: PoolEmbedder(EMBED_MODEL_NAME, workers=args.workers)
+    else:
+        embedder_factory = lambda: Embedder(EMBED_MODEL_NAME)
+    encoded = build.embed((mapping.rows(chunk, EMBED_MODEL_NAME) for chunk in records), embedder_factory,
+                          shard, num_shards, reuse=previous_vectors(ARTIFACTS_DIR))
+    print(f"Encoded {encoded} new or changed questions (build {build.build_id})")
 
-# Create FAISS index
-dimension = embeddings.shape[1]
-index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity
-index.add(embeddings)
+    if not build.complete():
+        print(f"Shard {shard}/{num_shards} done; other shards are still embedding")
+        return
+    version = build.assemble(EMBED_MODEL_NAME, args.index_type, report=not args.no_report, keep_build=args.keep_build)
+    if version is None:
+        print("Another process is assembling this build")
+        return
+    print(f"Artifacts created successfully! (snapshot {version})")
 
-# Save index
-faiss.write_index(index, "artifacts/qa_index.faiss")
 
-print("Artifacts created successfully!")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+# snapshots.py
+# Versioned retrieval artifacts under artifacts/snapshots/<version>/ with an atomic CURRENT pointer
+#
+#   artifacts/
+#     CURRENT                      name of the active snapshot (replaced atomically)
+#     snapshots/20250914T051123/   qa_index.faiss, qa_store/, ...
+#
+# Builders write a complete snapshot directory first and only then publish it, so readers
+# never see a half-written index. The app reloads when CURRENT changes (see app.py).
+import logging
+import os
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+SNAPSHOTS_DIRNAME = "snapshots"
+
+# How many published snapshots prune_snapshots keeps (the active one is never removed)
+SNAPSHOTS_KEEP = int(os.getenv("SNAPSHOTS_KEEP", "3"))
+
+
+def snapshots_root(artifacts_dir: Path) -> Path:
+    return Path(artifacts_dir) / SNAPSHOTS_DIRNAME
+
+
+def new_snapshot_dir(artifacts_dir: Path, version: Optional[str] = None) -> Path:
+    version = version or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path = snapshots_root(artifacts_dir) / version
+    suffix = 1
+    while path.exists():
+        path = snapshots_root(artifacts_dir) / f"{version}-{suffix}"
+        suffix += 1
+    path.mkdir(parents=True)
+    return path
+
+
+def current_version(artifacts_dir: Path) -> Optional[str]:
+    try:
+        version = (Path(artifacts_dir) / CURRENT_FILE).read_text().strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def resolve_snapshot(artifacts_dir: Path, version: Optional[str] = None) -> Path:
+    # Directory holding the active (or requested) snapshot; flat artifacts/ when nothing is published
+    version = version or current_version(artifacts_dir)
+    if version is None:
+        return Path(artifacts_dir)
+    path = snapshots_root(artifacts_dir) / version
+    if not path.is_dir():
+        raise FileNotFoundError(f"Snapshot {version} not found under {snapshots_root(artifacts_dir)}")
+    return path
+
+
+def publish_snapshot(artifacts_dir: Path, snapshot_dir: Path) -> str:
+    # Write CURRENT.tmp then os.replace: readers see either the old or the new version, never a partial file
+    version = Path(snapshot_dir).name
+    if not (snapshots_root(artifacts_dir) / version).is_dir():
+        raise FileNotFoundError(f"{snapshot_dir} is not a snapshot of {artifacts_dir}")
+    tmp = Path(artifacts_dir) / f"{CURRENT_FILE}.tmp"
+    with open(tmp, "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, Path(artifacts_dir) / CURRENT_FILE)
+    logger.info(f"Published snapshot {version}")
+    return version
+
+
+def list_snapshots(artifacts_dir: Path) -> List[str]:
+    root = snapshots_root(artifacts_dir)
+    if not root.is_dir():
+        return []
+    return sorted(p.name for p in root.iterdir() if p.is_dir())
+
+
+def prune_snapshots(artifacts_dir: Path, keep: int = SNAPSHOTS_KEEP) -> List[str]:
+    # Workers that haven't reloaded yet keep their mmaps valid after unlink, so removal is safe
+    active = current_version(artifacts_dir)
+    versions = [v for v in list_snapshots(artifacts_dir) if v != active]
+    removed = versions[:max(len(versions) - max(keep - 1, 0), 0)]
+    for version in removed:
+        shutil.rmtree(snapshots_root(artifacts_dir) / version, ignore_errors=True)
+        logger.info(f"Removed snapshot {version}")
+    return removed
@@ -0,0 +1,139 @@
+# conftest.py
+# Shared fixtures: the modules live at the repository root, and ingestion runs against an
+# in-memory knowledge_base and a hashing embedder instead of Postgres and a real model
+import sys
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from embedding_models import ActiveEmbedding  # noqa: E402
+
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DIMENSION = 384
+
+
+def hashed_vectors(texts: List[str], dimension: int = DIMENSION) -> np.ndarray:
+    # Bag of character trigrams: similar text -> similar vector, deterministic across runs
+    vectors = np.zeros((len(texts), dimension), dtype=np.float32)
+    for row, value in enumerate(texts):
+        value = value.lower()
+        for i in range(max(len(value) - 2, 1)):
+            vectors[row, zlib.crc32(value[i:i + 3].encode("utf-8")) % dimension] += 1.0
+    return vectors
+
+
+class HashingEmbedder:
+    """Stands in for ingest.Embedder; records every text it encodes."""
+
+    encoded: List[str] = []
+
+    def __init__(self, model_name: str = MODEL, batch_size: int = 0):
+        self.model_name = model_name
+        self.dimension = DIMENSION
+        self.max_seq_length = 256
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        HashingEmbedder.encoded.extend(texts)
+        return hashed_vectors(texts)
+
+    def embed(self, row_chunks):
+        from ingest import embedding_text
+
+        for rows in row_chunks:
+            yield rows, self.encode([embedding_text(r) for r in rows])
+
+    def close(self):
+        pass
+
+
+class MemoryKnowledgeBase:
+    """knowledge_base and kb_documents rows, shared by every writer of a test."""
+
+    def __init__(self):
+        self.rows: Dict[str, dict] = {}     # source_key -> row with its embedding
+        self.documents: Dict[tuple, dict] = {}
+        self.next_id = 1
+
+
+def memory_writer(kb: MemoryKnowledgeBase):
+    class MemoryWriter:
+        """KnowledgeBaseWriter and DocumentWriter over a MemoryKnowledgeBase."""
+
+        def __init__(self, database_url: str = "", method: str = "copy"):
+            self.embedding = ActiveEmbedding("embedding", None, 0)
+
+        def prepare(self):
+            pass
+
+        def stored_hashes(self, keys: List[str]) -> Dict[str, str]:
+            return {k: kb.rows[k]["content_hash"] for k in keys if k in kb.rows}
+
+        def stored_rows(self, keys: List[str]):
+            rows = sorted((kb.rows[k] for k in keys if k in kb.rows), key=lambda r: r["id"])
+            if not rows:
+                return [], np.zeros((0, 0), dtype=np.float32)
+            return ([{"question": r["question"], "source_key": r["source_key"]} for r in rows],
+                    np.vstack([r["embedding"] for r in rows]))
+
+        def recent_rows(self, limit: int):
+            rows = sorted(kb.rows.values(), key=lambda r: -r["id"])[:limit]
+            if rows:
+                yield ([{"question": r["question"], "source_key": r["source_key"]} for r in rows],
+                       np.vstack([r["embedding"] for r in rows]))
+
+        def column_dimension(self) -> Optional[int]:
+            return DIMENSION if kb.rows else None
+
+        def write(self, rows: List[dict], embeddings: np.ndarray, force: bool = False) -> int:
+            # Same guard as ingest.upsert_sql: a stored row with the same hash is left alone unless forced
+            written = 0
+            for row, embedding in zip(rows, embeddings):
+                stored = kb.rows.get(row["source_key"])
+                if stored is not None and stored["content_hash"] == row["content_hash"] and not force:
+                    continue
+                if stored is None:
+                    row_id, kb.next_id = kb.next_id, kb.next_id + 1
+                else:
+                    row_id = stored["id"]
+                kb.rows[row["source_key"]] = dict(row, id=row_id, embedding=np.array(embedding),
+                                                  writes=stored["writes"] + 1 if stored else 1)
+                written += 1
+            return written
+
+        def begin_document(self, source, document, language, category):
+            stored = kb.documents.setdefault((source, document.uri),
+                                             {"id": len(kb.documents) + 1, "content_hash": None})
+            return stored["id"], stored["content_hash"]
+
+        def finish_document(self, document_id: int, chunk_count: int, digest: str):
+            for key in [k for k, r in kb.rows.items()
+                        if r.get("document_id") == document_id and r["chunk_index"] >= chunk_count]:
+                del kb.rows[key]
+            for stored in kb.documents.values():
+                if stored["id"] == document_id:
+                    stored["content_hash"] = digest
+
+        def close(self):
+            pass
+
+    return MemoryWriter
+
+
+@pytest.fixture
+def memory_kb(monkeypatch):
+    import ingest
+    import ingest_documents
+
+    kb = MemoryKnowledgeBase()
+    writer = memory_writer(kb)
+    monkeypatch.setattr(ingest, "KnowledgeBaseWriter", writer)
+    monkeypatch.setattr(ingest, "Embedder", HashingEmbedder)
+    monkeypatch.setattr(ingest_documents, "DocumentWriter", writer)
+    monkeypatch.setattr(ingest_documents, "Embedder", HashingEmbedder)
+    monkeypatch.setattr(HashingEmbedder, "encoded", [])
+    return kb
@@ -0,0 +1,138 @@
+# test_artifact_build.py
+# Resumable snapshot builds (artifact_build.py) and the exact search behind the recall report
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from artifact_build import ArtifactBuild
+from conftest import MODEL, hashed_vectors
+from index_build import exact_search
+from kb_store import KBStore, content_hash
+from retrieval import normalize_rows
+from snapshots import resolve_snapshot
+
+SETTINGS = {"input": "faq.jsonl", "model": MODEL, "index_type": "flat"}
+CHUNKS, CHUNK_ROWS = 4, 5
+
+
+def row_chunks():
+    for i in range(CHUNKS):
+        rows = []
+        for j in range(CHUNK_ROWS):
+            question, answer = f"Question {i}-{j} about crop {j}", f"Answer {i}-{j}"
+            rows.append({"question": question, "answer": answer, "language": "en", "category": None,
+                         "content_hash": content_hash(question, answer, "en", MODEL)})
+        yield rows
+
+
+class Encoder:
+    """Counts the rows it encodes; fails on the call given by fail_at."""
+
+    def __init__(self, fail_at=None):
+        self.calls = 0
+        self.rows = 0
+        self.fail_at = fail_at
+
+    def encode(self, texts):
+        if self.calls == self.fail_at:
+            raise RuntimeError("killed")
+        self.calls += 1
+        self.rows += len(texts)
+        return hashed_vectors(texts, 16)
+
+    def close(self):
+        pass
+
+
+def embedded_build(tmp_path) -> ArtifactBuild:
+    build = ArtifactBuild(tmp_path, SETTINGS)
+    build.embed(row_chunks(), Encoder)
+    return build
+
+
+def chunk_vectors(build: ArtifactBuild, chunks) -> np.ndarray:
+    return normalize_rows(np.vstack([np.load(build.chunk_dir(i) / "embeddings.npy") for i in chunks]))
+
+
+def test_interrupted_embedding_resumes_with_the_missing_chunks(tmp_path):
+    build = ArtifactBuild(tmp_path, SETTINGS)
+    crashing = Encoder(fail_at=2)
+    with pytest.raises(RuntimeError):
+        build.embed(row_chunks(), lambda: crashing)
+    assert [build.chunk_done(i) for i in range(CHUNKS)] == [True, True, False, False]
+    assert not build.complete()
+
+    resumed = Encoder()
+    encoded = ArtifactBuild(tmp_path, SETTINGS).embed(row_chunks(), lambda: resumed)
+    assert encoded == resumed.rows == 2 * CHUNK_ROWS
+    assert build.complete()
+
+
+def test_resume_with_other_settings_is_refused(tmp_path):
+    ArtifactBuild(tmp_path, SETTINGS, build_id="b1")
+    with pytest.raises(RuntimeError):
+        ArtifactBuild(tmp_path, dict(SETTINGS, model="other"), build_id="b1")
+
+
+def test_reused_vectors_are_not_encoded(tmp_path):
+    first = embedded_build(tmp_path / "a")
+    reuse = {}
+    for rows, embeddings in first.iter_chunks():
+        reuse.update((r["content_hash"], np.array(e)) for r, e in zip(rows, embeddings))
+
+    encoder = Encoder()
+    assert ArtifactBuild(tmp_path / "b", SETTINGS).embed(row_chunks(), lambda: encoder, reuse=reuse) == 0
+    assert encoder.rows == 0
+
+
+def test_index_resume_follows_the_checkpoint_not_progress_json(tmp_path):
+    # A crash between the renames of partial.faiss (3 chunks) and progress.json (still 2)
+    build = embedded_build(tmp_path)
+    partial = faiss.IndexFlatIP(16)
+    partial.add(chunk_vectors(build, range(3)))
+    faiss.write_index(partial, str(build.index_dir / "partial.faiss"))
+    with open(build.index_dir / "progress.json", "w") as f:
+        json.dump({"factory": "Flat", "chunks_added": 2}, f)
+
+    index, factory = build.build_index("flat", checkpoint_every=1)
+    assert (index.ntotal, factory) == (CHUNKS * CHUNK_ROWS, "Flat")
+    np.testing.assert_allclose(index.reconstruct_n(0, index.ntotal), chunk_vectors(build, range(CHUNKS)), rtol=1e-6)
+    assert json.loads((build.index_dir / "progress.json").read_text())["chunks_added"] == CHUNKS
+
+
+def test_checkpoint_off_a_chunk_boundary_is_rebuilt(tmp_path):
+    build = embedded_build(tmp_path)
+    partial = faiss.IndexFlatIP(16)
+    partial.add(chunk_vectors(build, range(2))[:7])
+    faiss.write_index(partial, str(build.index_dir / "partial.faiss"))
+    with open(build.index_dir / "progress.json", "w") as f:
+        json.dump({"factory": "Flat", "chunks_added": 1}, f)
+
+    index, _ = build.build_index("flat")
+    assert index.ntotal == CHUNKS * CHUNK_ROWS
+
+
+def test_assemble_publishes_a_store_backed_snapshot(tmp_path):
+    build = embedded_build(tmp_path)
+    version = build.assemble(MODEL, "flat", report=False)
+    snapshot = resolve_snapshot(tmp_path, version)
+    assert (snapshot / "qa_index.faiss").exists() and not (snapshot / "qa_meta.pkl").exists()
+    store = KBStore(snapshot / "qa_store")
+    assert len(store) == CHUNKS * CHUNK_ROWS and store.questions[6] == "Question 1-1 about crop 1"
+    store.close()
+    assert not build.dir.exists()
+
+
+def test_exact_search_matches_a_flat_index_across_blocks(tmp_path):
+    rng = np.random.default_rng(0)
+    embeddings = normalize_rows(rng.standard_normal((300, 16)).astype(np.float32))
+    np.save(tmp_path / "embeddings.npy", embeddings)
+    mapped = np.load(tmp_path / "embeddings.npy", mmap_mode="r")
+    queries = embeddings[:20]
+
+    flat = faiss.IndexFlatIP(16)
+    flat.add(embeddings)
+    _, expected = flat.search(queries, 5)
+    np.testing.assert_array_equal(exact_search(queries, mapped, 5, block_rows=64), expected)
@@ -0,0 +1,52 @@
+# test_dedup.py
+# Near-duplicate filtering (dedup.py): updates vs duplicates, and seeding from stored rows
+import numpy as np
+
+from conftest import hashed_vectors
+from dedup import NearDuplicateFilter
+
+
+def rows(*pairs):
+    return [{"question": question, "source_key": key} for question, key in pairs]
+
+
+def test_text_duplicates_are_dropped_and_reported():
+    dedup = NearDuplicateFilter()
+    kept = dedup.filter_text(rows(("Best time to spray neem oil?", "a"), ("best time to spray  neem oil", "b"),
+                                  ("How deep to plant maize seed?", "c")))
+    assert [r["source_key"] for r in kept] == ["a", "c"]
+    assert dedup.text_duplicates == 1
+    assert dedup.drain_report() == [{"stage": "text", "question": "best time to spray  neem oil", "source": None,
+                                     "canonical": "Best time to spray neem oil?"}]
+
+
+def test_a_row_matching_its_own_stored_version_is_an_update():
+    dedup = NearDuplicateFilter()
+    dedup.seed(rows(("Best time to spray neem oil?", "a")))
+    assert dedup.filter_text(rows(("Best time to spray neem oil ?", "a"))) != []
+    assert dedup.text_duplicates == 0
+
+
+def test_seed_keeps_pending_report_entries():
+    dedup = NearDuplicateFilter()
+    dedup.filter_text(rows(("Best time to spray neem oil?", "a"), ("best time to spray neem oil", "b")))
+    assert len(dedup.report) == 1
+
+    dedup.seed(rows(("Which fertilizer for maize?", "c")))
+    assert len(dedup.report) == 1
+    assert dedup.filter_text(rows(("Which fertilizer for maize ?", "d"))) == []
+    assert [e["canonical"] for e in dedup.drain_report()] == ["Best time to spray neem oil?",
+                                                               "Which fertilizer for maize?"]
+
+
+def test_seeded_vectors_catch_paraphrases_without_counting_them():
+    dedup = NearDuplicateFilter(jaccard_threshold=1.0)
+    stored = ["Which fertilizer suits maize in sandy soil?"]
+    dedup.seed(rows((stored[0], "a")), hashed_vectors(stored))
+    assert dedup.embedding_duplicates == 0 and dedup.report == []
+
+    incoming = rows(("Which fertilizer suits maize in sandy soils?", "b"), ("When to harvest turmeric?", "c"))
+    kept, embeddings = dedup.filter_embeddings(incoming, hashed_vectors([r["question"] for r in incoming]))
+    assert [r["source_key"] for r in kept] == ["c"] and embeddings.shape == (1, 384)
+    assert dedup.embedding_duplicates == 1
+    np.testing.assert_array_equal(embeddings[0], hashed_vectors(["When to harvest turmeric?"])[0])
@@ -0,0 +1,71 @@
+# test_embed_batcher.py
+# Micro-batching of query embeddings (embed_batcher.py)
+import asyncio
+
+import numpy as np
+import pytest
+
+pytest.importorskip("fastapi")
+
+from embed_batcher import EmbedBatcher  # noqa: E402
+
+
+class Model:
+    """Stands in for a SentenceTransformer; records the texts of every forward pass."""
+
+    def __init__(self, offset: float = 0.0, fail: bool = False):
+        self.offset = offset
+        self.fail = fail
+        self.passes = []
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True):
+        if self.fail:
+            raise RuntimeError("out of memory")
+        self.passes.append(list(texts))
+        return np.array([[len(t) + self.offset, 1.0] for t in texts], dtype=np.float32)
+
+
+def test_concurrent_texts_share_a_forward_pass():
+    model = Model()
+    batcher = EmbedBatcher(max_batch=8, max_wait_ms=50)
+    texts = [f"question {i}" * (i + 1) for i in range(5)]
+
+    async def run():
+        return await asyncio.gather(*(batcher.encode(model, t) for t in texts))
+
+    vectors = asyncio.run(run())
+    assert model.passes == [texts]
+    assert [v[0] for v in vectors] == [len(t) for t in texts]
+    assert batcher.batches == 1 and batcher.texts == 5
+
+
+def test_batches_are_capped_at_max_batch():
+    model = Model()
+    batcher = EmbedBatcher(max_batch=2, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.encode(model, str(i)) for i in range(5)))
+
+    asyncio.run(run())
+    assert [len(p) for p in model.passes] == [2, 2, 1]
+
+
+def test_models_are_never_mixed_in_one_pass():
+    old, new = Model(), Model(offset=100.0)
+    batcher = EmbedBatcher(max_batch=8, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(batcher.encode(old, "a"), batcher.encode(new, "b"), batcher.encode(old, "c"))
+
+    vectors = asyncio.run(run())
+    assert old.passes == [["a", "c"]] and new.passes == [["b"]]
+    assert [v[0] for v in vectors] == [1.0, 101.0, 1.0]
+
+
+def test_encode_errors_reach_every_caller_in_the_batch():
+    batcher = EmbedBatcher(max_batch=8, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.encode(Model(fail=True), t) for t in "ab"), return_exceptions=True)
+
+    assert all(isinstance(result, RuntimeError) for result in asyncio.run(run()))
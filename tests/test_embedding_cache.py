@@ -0,0 +1,133 @@
+# test_embedding_cache.py
+# Query embedding cache (embedding_cache.py): key normalization, Redis fallback and in-flight dedup
+import asyncio
+
+import numpy as np
+import pytest
+
+from embedding_cache import EmbeddingCache, cache_key, normalize_text
+
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class Encoder:
+    """Async encode function that counts calls and can be held until released."""
+
+    def __init__(self):
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def __call__(self, value: str) -> np.ndarray:
+        self.calls.append(value)
+        await self.release.wait()
+        return np.array([len(value), 1.0, 0.5], dtype=np.float32)
+
+
+class FakeRedis:
+    def __init__(self, fail: bool = False):
+        self.data = {}
+        self.fail = fail
+
+    async def get(self, key):
+        if self.fail:
+            raise ConnectionError("redis down")
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        if self.fail:
+            raise ConnectionError("redis down")
+        self.data[key] = value
+
+
+def test_keys_ignore_case_width_and_whitespace():
+    assert normalize_text("  How to  control\taphids? ") == "how to control aphids?"
+    assert normalize_text("ＡＢＣ") == "abc"
+    assert cache_key(MODEL, "How to control aphids?") == cache_key(MODEL, "how to  control APHIDS?")
+    assert cache_key(MODEL, "aphids") != cache_key("other-model", "aphids")
+    assert cache_key(MODEL, "aphids", "torch") != cache_key(MODEL, "aphids", "onnx-int8")
+
+
+def test_spellings_share_one_encode():
+    cache, encode = EmbeddingCache(), Encoder()
+
+    async def run():
+        first = await cache.get_or_encode(MODEL, "How to control aphids?", encode)
+        second = await cache.get_or_encode(MODEL, "how to control  aphids?", encode)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert encode.calls == ["How to control aphids?"] and second is first
+    assert not first.flags.writeable
+    assert cache.stats()["misses"] == 1 and cache.stats()["local_hits"] == 1
+
+
+def test_concurrent_misses_wait_on_one_encode():
+    cache, encode = EmbeddingCache(), Encoder()
+
+    async def run():
+        encode.release.clear()
+        lookups = asyncio.gather(*(cache.get_or_encode(MODEL, text, encode) for text in ("Aphids", "aphids", "APHIDS")))
+        await asyncio.sleep(0)
+        encode.release.set()
+        return await lookups
+
+    vectors = asyncio.run(run())
+    assert len(encode.calls) == 1
+    assert all(v is vectors[0] for v in vectors)
+    assert cache._inflight == {}
+
+
+def test_a_cancelled_lookup_does_not_fail_its_waiters():
+    cache, encode = EmbeddingCache(), Encoder()
+
+    async def run():
+        encode.release.clear()
+        first = asyncio.ensure_future(cache.get_or_encode(MODEL, "aphids", encode))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(cache.get_or_encode(MODEL, "aphids", encode))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        encode.release.set()
+        return await second
+
+    vector = asyncio.run(run())
+    assert encode.calls == ["aphids", "aphids"] and vector[0] == 6
+
+
+def test_redis_is_shared_and_optional():
+    redis, encode = FakeRedis(), Encoder()
+    asyncio.run(EmbeddingCache(redis).get_or_encode(MODEL, "aphids", encode))
+    # Another worker: local miss, Redis hit (stored as float16)
+    other = EmbeddingCache(redis)
+    vector = asyncio.run(other.get_or_encode(MODEL, "Aphids", encode))
+    assert encode.calls == ["aphids"] and other.stats()["redis_hits"] == 1
+    np.testing.assert_array_equal(vector, [6.0, 1.0, 0.5])
+
+    down = EmbeddingCache(FakeRedis(fail=True))
+    asyncio.run(down.get_or_encode(MODEL, "aphids", encode))
+    assert down.stats()["redis_errors"] == 2 and down.stats()["misses"] == 1
+
+
+def test_encode_errors_reach_the_caller_and_are_not_cached():
+    cache = EmbeddingCache()
+
+    async def broken(value):
+        raise RuntimeError("model unavailable")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(cache.get_or_encode(MODEL, "aphids", broken))
+    assert cache.stats()["local_entries"] == 0 and cache._inflight == {}
+
+
+def test_local_entries_are_bounded():
+    cache, encode = EmbeddingCache(max_entries=2), Encoder()
+
+    async def run():
+        for text in ("a", "b", "a", "c"):
+            await cache.get_or_encode(MODEL, text, encode)
+
+    asyncio.run(run())
+    # "b" was least recently used when "c" arrived
+    assert list(cache._local) == [cache_key(MODEL, "a"), cache_key(MODEL, "c")]
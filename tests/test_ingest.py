@@ -0,0 +1,83 @@
+# test_ingest.py
+# Hash upserts and near-duplicate filtering of ingest.py against an in-memory knowledge_base
+import json
+
+from conftest import MODEL, HashingEmbedder
+from dedup import NearDuplicateFilter
+from ingest import ColumnMapping, ingest
+
+
+def write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+    return path
+
+
+RECORDS = [
+    {"question": "How much urea for paddy per acre?", "answer": "50 kg in three splits."},
+    {"question": "When to sow groundnut in kharif?", "answer": "June to July, after the first rains."},
+    {"question": "What controls pink bollworm in cotton?", "answer": "Pheromone traps and timely sowing."},
+]
+
+
+def test_unchanged_rows_are_not_re_embedded(tmp_path, memory_kb):
+    path = write_jsonl(tmp_path / "faq.jsonl", RECORDS)
+    first = ingest(path, ColumnMapping(source="faq"), model_name=MODEL)
+    assert (first.written, first.skipped) == (3, 0)
+
+    HashingEmbedder.encoded.clear()
+    second = ingest(path, ColumnMapping(source="faq"), model_name=MODEL)
+    assert (second.written, second.skipped) == (0, 3)
+    assert HashingEmbedder.encoded == []
+
+
+def test_edited_answer_updates_its_row_in_place(tmp_path, memory_kb):
+    ingest(write_jsonl(tmp_path / "faq.jsonl", RECORDS), ColumnMapping(source="faq"), model_name=MODEL)
+    ids = {r["question"]: r["id"] for r in memory_kb.rows.values()}
+
+    edited = [dict(RECORDS[0], answer="55 kg in three splits.")] + RECORDS[1:]
+    HashingEmbedder.encoded.clear()
+    progress = ingest(write_jsonl(tmp_path / "faq.jsonl", edited), ColumnMapping(source="faq"), model_name=MODEL)
+    assert (progress.written, progress.skipped) == (1, 2)
+    assert HashingEmbedder.encoded == [RECORDS[0]["question"]]
+    assert len(memory_kb.rows) == 3
+    row = next(r for r in memory_kb.rows.values() if r["question"] == RECORDS[0]["question"])
+    assert row["answer"] == "55 kg in three splits." and row["id"] == ids[row["question"]]
+
+
+def test_same_content_under_another_source_is_inserted(tmp_path, memory_kb):
+    # The content hash doesn't cover the source: a matching hash stored under another key isn't this row
+    path = write_jsonl(tmp_path / "faq.jsonl", RECORDS)
+    ingest(path, ColumnMapping(source="faq"), model_name=MODEL)
+    progress = ingest(path, ColumnMapping(source="mirror"), model_name=MODEL)
+    assert (progress.written, progress.skipped) == (3, 0)
+    assert len(memory_kb.rows) == 6
+
+
+def test_force_re_embeds_everything(tmp_path, memory_kb):
+    path = write_jsonl(tmp_path / "faq.jsonl", RECORDS)
+    ingest(path, ColumnMapping(source="faq"), model_name=MODEL)
+    progress = ingest(path, ColumnMapping(source="faq"), model_name=MODEL, force=True)
+    assert (progress.written, progress.skipped) == (3, 0)
+    assert len(memory_kb.rows) == 3
+    # Rewritten even though their content hashes didn't change
+    assert [r["writes"] for r in memory_kb.rows.values()] == [2, 2, 2]
+
+
+def test_unchanged_rows_stay_canonical_for_dedup(tmp_path, memory_kb):
+    # Re-ingesting a file that gained a near-duplicate of a stored row drops the newcomer,
+    # even though the stored row is skipped as unchanged and never reaches the filter itself
+    path = write_jsonl(tmp_path / "faq.jsonl", RECORDS)
+    ingest(path, ColumnMapping(source="faq"), model_name=MODEL, dedup=NearDuplicateFilter())
+
+    grown = RECORDS + [{"question": "How much urea for paddy per acre ?", "answer": "Fifty kilograms."}]
+    report = tmp_path / "duplicates.jsonl"
+    dedup = NearDuplicateFilter()
+    progress = ingest(write_jsonl(path, grown), ColumnMapping(source="faq"), model_name=MODEL, dedup=dedup,
+                      dedup_report=report)
+    assert (progress.written, progress.skipped, progress.duplicates) == (0, 3, 1)
+    assert len(memory_kb.rows) == 3
+    entries = [json.loads(line) for line in report.read_text(encoding="utf-8").splitlines()]
+    assert [e["canonical"] for e in entries] == [RECORDS[0]["question"]]
+
@@ -0,0 +1,70 @@
+# test_ingest_documents.py
+# Chunking and positional re-keying of ingest_documents.py against an in-memory knowledge_base
+from conftest import MODEL, HashingEmbedder
+from ingest_documents import chunk_text, ingest_documents
+
+
+def words(value: str) -> int:
+    return len(value.split())
+
+
+def manual(*sections: str) -> str:
+    return "# Rice Manual\n\n" + "\n\n".join(f"## {name}\n\n{name} text. More about {name.lower()}."
+                                              for name in sections)
+
+
+def stored_chunks(kb):
+    return sorted((r["chunk_index"], r["question"], r["answer"]) for r in kb.rows.values())
+
+
+def test_chunk_text_respects_budget_and_overlap():
+    value = " ".join(f"Sentence {i} has five words." for i in range(20))
+    chunks = chunk_text(value, words, max_tokens=12, overlap_tokens=5)
+    assert all(words(c) <= 12 for c in chunks)
+    # Each chunk starts with the last sentence of the previous one
+    for previous, current in zip(chunks, chunks[1:]):
+        assert current.startswith(previous.split(". ")[-1].rstrip("."))
+    assert chunks[-1].endswith("Sentence 19 has five words.")
+
+
+def test_chunk_text_splits_overlong_sentences_at_words():
+    chunks = chunk_text("one two three four five six seven", words, max_tokens=3, overlap_tokens=0)
+    assert chunks == ["one two three", "four five six", "seven"]
+
+
+def test_unchanged_document_is_skipped(tmp_path, memory_kb):
+    (tmp_path / "rice.md").write_text(manual("Nursery", "Transplanting", "Harvest"), encoding="utf-8")
+    first = ingest_documents(tmp_path, "manuals", model_name=MODEL)
+    assert first.written == 3
+
+    HashingEmbedder.encoded.clear()
+    second = ingest_documents(tmp_path, "manuals", model_name=MODEL)
+    assert second.read == 0 and HashingEmbedder.encoded == []
+
+
+def test_inserted_section_re_keys_the_chunks_after_it(tmp_path, memory_kb):
+    path = tmp_path / "rice.md"
+    path.write_text(manual("Nursery", "Transplanting", "Harvest"), encoding="utf-8")
+    ingest_documents(tmp_path, "manuals", model_name=MODEL)
+
+    # Chunks are keyed by position: every chunk after the insertion moves and is re-embedded
+    path.write_text(manual("Varieties", "Nursery", "Transplanting", "Harvest"), encoding="utf-8")
+    progress = ingest_documents(tmp_path, "manuals", model_name=MODEL)
+    assert (progress.written, progress.skipped) == (4, 0)
+    assert [(i, q.split(" > ")[-1]) for i, q, _ in stored_chunks(memory_kb)] == [
+        (0, "Varieties"), (1, "Nursery"), (2, "Transplanting"), (3, "Harvest")]
+
+
+def test_edit_re_embeds_only_changed_positions_and_drops_the_tail(tmp_path, memory_kb):
+    path = tmp_path / "rice.md"
+    path.write_text(manual("Nursery", "Transplanting", "Harvest"), encoding="utf-8")
+    ingest_documents(tmp_path, "manuals", model_name=MODEL)
+
+    path.write_text(manual("Nursery", "Transplanting", "Storage"), encoding="utf-8")
+    progress = ingest_documents(tmp_path, "manuals", model_name=MODEL)
+    assert (progress.written, progress.skipped) == (1, 2)
+
+    path.write_text(manual("Nursery"), encoding="utf-8")
+    progress = ingest_documents(tmp_path, "manuals", model_name=MODEL)
+    assert (progress.written, progress.skipped) == (0, 1)
+    assert [(i, q.split(" > ")[-1]) for i, q, _ in stored_chunks(memory_kb)] == [(0, "Nursery")]
@@ -0,0 +1,149 @@
+# test_llm_pool.py
+# Checkout, check-in and cancellation paths of LlamaPool (llm_pool.py) over a fake llama_cpp module
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from llm_pool import LlamaPool  # noqa: E402
+
+
+class FakeLlama:
+    loaded = 0
+    gate = threading.Event()    # loads wait for it, so a test can cancel a request mid-load
+    fail = False
+
+    def __init__(self, **kwargs):
+        FakeLlama.gate.wait()
+        if FakeLlama.fail:
+            raise RuntimeError("not a GGUF file")
+        FakeLlama.loaded += 1
+
+    def create_completion(self, prompt, stream=False, **kwargs):
+        for word in ("fifty", " kilograms", " per", " acre"):
+            yield {"choices": [{"text": word}]}
+
+
+@pytest.fixture
+def pool(monkeypatch, tmp_path):
+    monkeypatch.setitem(sys.modules, "llama_cpp", types.SimpleNamespace(Llama=FakeLlama))
+    monkeypatch.setattr(FakeLlama, "loaded", 0)
+    monkeypatch.setattr(FakeLlama, "fail", False)
+    FakeLlama.gate.set()
+    return lambda size=2: LlamaPool(tmp_path / "model.gguf", size=size, threads=2)
+
+
+def test_contexts_are_loaded_on_demand_and_reused(pool):
+    llama = pool(size=2)
+
+    async def run():
+        async with llama.acquire() as first:
+            async with llama.acquire() as second:
+                assert first is not second and llama.in_use == 2
+        async with llama.acquire() as again:
+            return again in (first, second)
+
+    assert asyncio.run(run())
+    assert FakeLlama.loaded == 2
+    stats = llama.stats()
+    assert (stats["loaded"], stats["in_use"], stats["acquisitions"]) == (2, 0, 3)
+
+
+def test_requests_beyond_the_size_wait_for_a_checkin(pool):
+    llama = pool(size=1)
+    order = []
+
+    async def use(name):
+        async with llama.acquire():
+            order.append(f"{name} in")
+            await asyncio.sleep(0.01)
+            order.append(f"{name} out")
+
+    async def run():
+        await asyncio.gather(use("a"), use("b"))
+
+    asyncio.run(run())
+    assert order == ["a in", "a out", "b in", "b out"] and FakeLlama.loaded == 1
+
+
+def test_cancel_during_load_keeps_the_slot(pool):
+    llama = pool(size=1)
+
+    async def run():
+        FakeLlama.gate.clear()
+        request = asyncio.ensure_future(llama.run(lambda llm: "answer"))
+        await asyncio.sleep(0.01)
+        request.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await request
+        FakeLlama.gate.set()
+        # The context loaded for the cancelled request serves the next one
+        return await asyncio.wait_for(llama.run(lambda llm: "answer"), 5)
+
+    assert asyncio.run(run()) == "answer"
+    assert FakeLlama.loaded == 1 and llama.stats()["loaded"] == 1 and llama.waiting == 0
+
+
+def test_failed_load_frees_the_slot(pool):
+    llama = pool(size=1)
+
+    async def run():
+        FakeLlama.fail = True
+        with pytest.raises(RuntimeError):
+            await llama.run(lambda llm: "answer")
+        assert llama.stats()["loaded"] == 0
+        FakeLlama.fail = False
+        return await llama.run(lambda llm: "answer")
+
+    assert asyncio.run(run()) == "answer"
+
+
+def test_warm_loads_every_context(pool):
+    llama = pool(size=3)
+    asyncio.run(llama.warm())
+    assert FakeLlama.loaded == 3 and llama._idle.qsize() == 3
+
+
+def test_cancelled_run_returns_the_context_when_fn_finishes(pool):
+    llama = pool(size=1)
+    started, finish = threading.Event(), threading.Event()
+
+    def generate(llm):
+        started.set()
+        finish.wait(5)
+        return "answer"
+
+    async def run():
+        request = asyncio.ensure_future(llama.run(generate))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait)
+        request.cancel()
+        await asyncio.sleep(0.01)
+        # Still generating: the context must not be handed out yet
+        assert llama.in_use == 1 and llama._idle.empty()
+        finish.set()
+        return await asyncio.wait_for(llama.run(lambda llm: "next"), 5)
+
+    assert asyncio.run(run()) == "next"
+    assert llama.in_use == 0
+
+
+def test_stream_yields_deltas_and_counts_aborts(pool):
+    llama = pool(size=1)
+
+    async def run():
+        full = [delta async for delta in llama.stream("How much urea?")]
+        partial = llama.stream("How much urea?")
+        first = await partial.__anext__()
+        await partial.aclose()
+        # The producer thread stops at its next token and checks the context back in
+        while llama.in_use:
+            await asyncio.sleep(0.001)
+        return full, first
+
+    full, first = asyncio.run(run())
+    assert "".join(full) == "fifty kilograms per acre" and first == "fifty"
+    assert llama.stats()["aborted"] == 1
@@ -0,0 +1,176 @@
+# test_llm_scheduler.py
+# Continuous batching (llm_scheduler.py) driven through a fake llama_cpp module: the fake
+# decodes one token per position and checks every sequence's KV positions stay contiguous
+import asyncio
+import ctypes
+import sys
+import threading
+import types
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from llm_scheduler import GenerationScheduler  # noqa: E402
+
+VOCAB = 8
+BOS, EOS, END = 1, 6, 7
+LETTERS = b"_^abcd$!"
+
+
+def next_token(position: int) -> int:
+    # What the fake model predicts after the token at this position: a, b, c, d, a, ...
+    return 2 + position % 4
+
+
+class FakeLlama:
+    def __init__(self, **kwargs):
+        self.context_params = types.SimpleNamespace()
+        self._model = types.SimpleNamespace(model=object())
+
+    def tokenize(self, data: bytes, add_bos: bool = True, special: bool = True):
+        if data == b"<|end|>":
+            return [END]
+        # One token per word; the word length picks the id, so a word merged across a seam re-tokenizes
+        return ([BOS] if add_bos else []) + [2 + len(word) % 4 for word in data.split()]
+
+    def n_vocab(self):
+        return VOCAB
+
+    def token_eos(self):
+        return EOS
+
+    def detokenize(self, tokens):
+        return bytes(LETTERS[t] for t in tokens)
+
+
+class FakeContext:
+    def __init__(self, gate: threading.Event):
+        self.kv = {}        # seq id -> positions decoded into it
+        self.logits = {}
+        self.batches = []
+        self.gate = gate    # decoding waits for it, so a test can queue requests first
+
+
+def fake_llama_cpp(gate: threading.Event) -> types.ModuleType:
+    module = types.ModuleType("llama_cpp")
+    module.Llama = FakeLlama
+    module.llama_new_context_with_model = lambda model, params: FakeContext(gate)
+
+    def batch_init(n_tokens, embd, n_seq_max):
+        return types.SimpleNamespace(token=[0] * n_tokens, pos=[0] * n_tokens, n_seq_id=[0] * n_tokens,
+                                     seq_id=[[0] for _ in range(n_tokens)], logits=[False] * n_tokens, n_tokens=0)
+
+    def decode(ctx, batch):
+        ctx.gate.wait()
+        ctx.batches.append(sorted({batch.seq_id[i][0] for i in range(batch.n_tokens)}))
+        ctx.logits = {}
+        for i in range(batch.n_tokens):
+            positions = ctx.kv.setdefault(batch.seq_id[i][0], [])
+            if batch.pos[i] != len(positions):
+                return -1
+            positions.append(batch.pos[i])
+            if batch.logits[i]:
+                logits = (ctypes.c_float * VOCAB)()
+                logits[next_token(batch.pos[i])] = 10.0
+                ctx.logits[i] = logits
+        return 0
+
+    def seq_cp(ctx, src, dst, start, end):
+        ctx.kv[dst] = [p for p in ctx.kv.get(src, []) if start <= p < end]
+
+    module.llama_batch_init = batch_init
+    module.llama_decode = decode
+    module.llama_get_logits_ith = lambda ctx, i: ctypes.cast(ctx.logits[i], ctypes.POINTER(ctypes.c_float))
+    module.llama_kv_cache_seq_rm = lambda ctx, seq_id, start, end: ctx.kv.pop(seq_id, None)
+    module.llama_kv_cache_seq_cp = seq_cp
+    return module
+
+
+def expected(prompt: str, max_tokens: int, stop: str = "") -> str:
+    n = len(FakeLlama().tokenize(prompt.encode("utf-8")))
+    text = "".join(chr(LETTERS[next_token(p)]) for p in range(n - 1, n - 1 + max_tokens))
+    return text.split(stop)[0] if stop else text
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    gate.set()
+    return gate
+
+
+@pytest.fixture
+def scheduler(monkeypatch, tmp_path, gate):
+    monkeypatch.setitem(sys.modules, "llama_cpp", fake_llama_cpp(gate))
+    return lambda **kwargs: GenerationScheduler(tmp_path / "model.gguf", n_ctx=64, threads=1, **kwargs)
+
+
+def test_requests_share_decode_steps(scheduler, gate):
+    generator = scheduler(sequences=2, batch_tokens=16)
+    prompts = [("what is the best urea dose", 5), ("when", 3), ("how to store paddy seed", 7), ("why", 4)]
+
+    async def run():
+        # The first step waits until every request is queued, so the batch composition is deterministic
+        gate.clear()
+        answers = asyncio.gather(*(generator.complete(p, n) for p, n in prompts))
+        while len(generator._pending) + len(generator._active) < len(prompts):
+            await asyncio.sleep(0.001)
+        gate.set()
+        return await answers
+
+    assert asyncio.run(run()) == [expected(p, n) for p, n in prompts]
+    stats = generator.stats()
+    assert stats["requests_finished"] == 4 and stats["active"] == 0 and stats["queued"] == 0
+    assert stats["tokens_generated"] == sum(n for _, n in prompts)
+    # Up to two sequences per step, and finished ones free their KV cells
+    assert stats["mean_batch_sequences"] > 1
+    assert max(len(seqs) for seqs in generator.ctx.batches) == 2
+    assert generator.ctx.kv == {}
+
+
+def test_stop_strings_end_the_answer(scheduler):
+    generator = scheduler(sequences=1)
+    prompt = "one two three"
+    answer = asyncio.run(generator.complete(prompt, 8, stop=["c"]))
+    assert answer == expected(prompt, 8, stop="c") and "c" not in answer
+
+
+def test_prompt_prefix_is_reused_when_tokens_agree(scheduler):
+    prefix = "you answer farmers questions"
+    generator = scheduler(sequences=2, prefix=prefix)
+    prompts = [f"{prefix} about rice", f"{prefix} about cotton pests", f"{prefix}x merged words"]
+
+    async def run():
+        return await asyncio.gather(*(generator.complete(p, 4) for p in prompts))
+
+    assert asyncio.run(run()) == [expected(p, 4) for p in prompts]
+    stats = generator.stats()
+    # The third prompt starts with the prefix text but tokenizes differently across the seam
+    assert stats["prefix_tokens"] == 5
+    assert stats["prefix_tokens_reused"] == 2 * 5
+    assert stats["prefix_mismatches"] == 1
+    # Only the reserved prefix sequence keeps KV cells
+    assert list(generator.ctx.kv) == [generator.prefix_seq]
+
+
+def test_cancelled_requests_free_their_sequence_and_count_once(scheduler, gate):
+    generator = scheduler(sequences=1)
+
+    async def run():
+        # Held in its first decode step, so the request is active when its consumer goes away
+        gate.clear()
+        answer = asyncio.ensure_future(generator.complete("what is the best urea dose", 20))
+        while not generator._active:
+            await asyncio.sleep(0.001)
+        answer.cancel()
+        await asyncio.sleep(0.01)
+        gate.set()
+        while generator._active:
+            await asyncio.sleep(0.001)
+        return await generator.complete("when", 3)
+
+    assert asyncio.run(run()) == expected("when", 3)
+    stats = generator.stats()
+    assert (stats["requests_cancelled"], stats["requests_finished"]) == (1, 1)
+    assert generator.ctx.kv == {}
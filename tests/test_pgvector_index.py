@@ -0,0 +1,101 @@
+# test_pgvector_index.py
+# SQL built by pgvector_index.py for the index DDL, the filtered and quantized searches and the
+# per-request recall settings
+import pytest
+
+from pgvector_index import (create_index_sql, filter_clause, ivfflat_lists_for, language_predicate, search_params,
+                            search_settings_sql, search_sql)
+
+
+def test_hnsw_index_ddl():
+    assert create_index_sql("hnsw", m=24, ef_construction=100, concurrently=True) == (
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_knowledge_base_embedding_hnsw "
+        "ON knowledge_base USING hnsw (embedding vector_cosine_ops) WITH (m = 24, ef_construction = 100)"
+    )
+    with pytest.raises(ValueError):
+        create_index_sql("diskann")
+
+
+def test_ivfflat_lists_follow_the_row_count():
+    assert ivfflat_lists_for(0) == 1
+    assert ivfflat_lists_for(250_000) == 250
+    assert ivfflat_lists_for(4_000_000) == 2000
+    assert create_index_sql("ivfflat", rows=50_000).endswith("USING ivfflat (embedding vector_cosine_ops) WITH (lists = 50)")
+
+
+def test_search_settings_are_forced_to_integers():
+    assert search_settings_sql(ef_search=100, probes=20) == [
+        "SET LOCAL hnsw.ef_search = 100",
+        "SET LOCAL ivfflat.probes = 20",
+    ]
+    with pytest.raises(ValueError):
+        search_settings_sql(ef_search="40; DROP TABLE knowledge_base")
+
+
+def test_search_settings_cover_the_rerank_shortlist():
+    assert search_settings_sql(ef_search=40, candidates=80)[0] == "SET LOCAL hnsw.ef_search = 80"
+
+
+def test_language_predicate_only_inlines_language_codes():
+    assert language_predicate("te") == "language = 'te'"
+    for value in ("", None, "EN", "te'; DROP TABLE knowledge_base; --", "t"):
+        with pytest.raises(ValueError):
+            language_predicate(value)
+
+
+def test_filter_clause():
+    assert filter_clause() == ""
+    assert filter_clause("hi") == "WHERE language = 'hi' "
+    assert filter_clause("hi", "rice") == "WHERE language = 'hi' AND category = :category "
+    assert filter_clause(category="rice") == "WHERE category = :category "
+
+
+def test_vector_search_orders_by_the_float_column():
+    assert search_sql("vector") == (
+        "SELECT id, question, answer FROM knowledge_base "
+        "ORDER BY embedding <=> CAST(:emb AS vector) LIMIT :top_k"
+    )
+    assert search_sql("vector", language="te", category="rice").startswith(
+        "SELECT id, question, answer FROM knowledge_base WHERE language = 'te' AND category = :category ORDER BY"
+    )
+
+
+def test_quantized_search_repeats_the_indexed_expression_and_reranks():
+    sql = search_sql("halfvec", 384, language="te")
+    # The coarse ORDER BY must match the index expression verbatim or the planner won't use the index
+    assert "(embedding::halfvec(384)) halfvec_cosine_ops" in create_index_sql("hnsw", storage="halfvec", dimension=384)
+    assert "WHERE language = 'te' ORDER BY embedding::halfvec(384) <=> CAST(:emb AS halfvec(384)) LIMIT :candidates" in sql
+    assert sql.endswith(") AS candidates ORDER BY embedding <=> CAST(:emb AS vector) LIMIT :top_k")
+    assert "binary_quantize(embedding)::bit(384) <~> binary_quantize(CAST(:emb AS vector))" in search_sql("binary", 384)
+    with pytest.raises(ValueError):
+        search_sql("pq", 384)
+    with pytest.raises(ValueError):
+        create_index_sql("hnsw", storage="halfvec")
+
+
+def test_search_sql_uses_the_given_column():
+    sql = search_sql("halfvec", 768, column="embedding_v2")
+    assert "embedding_v2::halfvec(768)" in sql and "ORDER BY embedding_v2 <=> CAST(:emb AS vector)" in sql
+    with pytest.raises(ValueError):
+        search_sql("vector", column="embedding; --")
+
+
+def test_search_params_bind_what_the_sql_uses():
+    params = search_params([0.5, 0.25], top_k=5, storage="halfvec", category="rice")
+    assert params["emb"] == "[0.5,0.25]" and params["top_k"] == 5 and params["category"] == "rice"
+    assert params["candidates"] >= 5
+    assert set(search_params([1.0], top_k=3)) == {"emb", "top_k"}
+
+
+def test_partial_index_carries_the_language_predicate():
+    sql = create_index_sql("hnsw", storage="vector", language="te")
+    assert sql.startswith("CREATE INDEX IF NOT EXISTS ix_knowledge_base_embedding_hnsw_te ON knowledge_base USING hnsw")
+    assert sql.endswith(" WHERE language = 'te'")
+
+
+def test_filtered_searches_can_turn_on_iterative_scans(monkeypatch):
+    import pgvector_index
+
+    monkeypatch.setattr(pgvector_index, "HNSW_ITERATIVE_SCAN", "relaxed_order")
+    assert search_settings_sql(filtered=True)[-1] == "SET LOCAL hnsw.iterative_scan = relaxed_order"
+    assert len(search_settings_sql(filtered=False)) == 2
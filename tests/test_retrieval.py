@@ -0,0 +1,153 @@
+# test_retrieval.py
+# NumPy exact search, incremental FAISS upserts/deletes over a KB store and the filter partitions behind them
+import numpy as np
+import pytest
+
+from index_build import exact_search
+from kb_store import KBStore, write_store
+from pgvector_index import vector_literal
+from retrieval import IncrementalFaissRetriever, NumpyRetriever, Partitions, normalize_rows, store_partitions
+
+MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DIMENSION = 8
+
+
+def basis(i: int) -> np.ndarray:
+    vector = np.zeros(DIMENSION, dtype=np.float32)
+    vector[i] = 1.0
+    return vector
+
+
+@pytest.fixture
+def store(tmp_path):
+    # kb ids 101..104 on basis vectors 0..3, alternating te/hi
+    write_store(tmp_path / "qa_store", [101, 102, 103, 104], np.stack([basis(i) for i in range(4)]),
+                {"questions": [f"q{i}" for i in range(4)], "answers": [f"a{i}" for i in range(4)],
+                 "languages": ["te", "hi", "te", "hi"], "categories": ["rice", "rice", "", "cotton"]},
+                model=MODEL)
+    store = KBStore(tmp_path / "qa_store")
+    yield store
+    store.close()
+
+
+def numpy_retriever(rows: int, dtype=np.float32, **kwargs) -> NumpyRetriever:
+    rng = np.random.default_rng(0)
+    matrix = normalize_rows(rng.standard_normal((rows, 16)).astype(np.float32)).astype(dtype)
+    labels = [str(i) for i in range(rows)]
+    return NumpyRetriever(matrix, list(range(rows)), labels, labels, **kwargs)
+
+
+def test_numpy_search_matches_exact_search_across_blocks():
+    retriever = numpy_retriever(300, block_rows=64)
+    queries = np.random.default_rng(1).standard_normal((20, 16)).astype(np.float32)
+    scores, found = retriever.search_indices(queries, top_k=5)
+    np.testing.assert_array_equal(found, exact_search(normalize_rows(queries), retriever.matrix, 5))
+    assert np.all(np.diff(scores, axis=1) <= 0)
+
+
+def test_numpy_search_over_float16_rows_and_a_partition():
+    retriever = numpy_retriever(300, dtype=np.float16, block_rows=50)
+    queries = np.random.default_rng(2).standard_normal((10, 16)).astype(np.float32)
+    rows = np.arange(1, 300, 3)
+    _, found = retriever.search_indices(queries, top_k=4, rows=rows)
+    # Exact search over the subset gives subset positions; map them back to matrix rows
+    expected = rows[exact_search(normalize_rows(queries), retriever.matrix[rows].astype(np.float32), 4)]
+    np.testing.assert_array_equal(found, expected)
+
+
+def test_numpy_search_returns_fewer_hits_than_top_k_on_small_matrices():
+    retriever = numpy_retriever(2)
+    hits = retriever.search(retriever.matrix[1:2].astype(np.float32), top_k=5)
+    assert [hit[0] for hit in hits[0]] == [1, 0]
+    with pytest.raises(ValueError):
+        retriever.search_indices(np.ones((1, 8), dtype=np.float32))
+
+
+def top(retriever, i: int, **filters):
+    return [hit[:3] for hit in retriever.search(basis(i)[None, :], top_k=1, filters=filters or None)[0]]
+
+
+def test_base_rows_are_searchable_with_filters(store):
+    retriever = IncrementalFaissRetriever.from_store(store)
+    assert retriever.model_name == MODEL and len(retriever) == 4
+    assert top(retriever, 2) == [(103, "q2", "a2")]
+    assert top(retriever, 2, language="hi")[0][0] in (102, 104)
+    assert top(retriever, 0, language="hi", category="cotton") == [(104, "q3", "a3")]
+    assert top(retriever, 0, language="ta") == []
+    assert top(retriever, 0, language=None) == [(101, "q0", "a0")]
+
+
+def test_upsert_replaces_and_delete_hides_rows(store):
+    retriever = IncrementalFaissRetriever.from_store(store)
+    # Update 101 onto basis 5 and add 105 on basis 6
+    retriever.upsert([101, 105], ["q0 new", "q5"], ["a0 new", "a5"], np.stack([basis(5), basis(6)]),
+                     languages=["te", "ta"], categories=["rice", None])
+    assert len(retriever) == 5 and retriever.tombstone_ratio() == pytest.approx(1 / 6)
+    assert top(retriever, 5) == [(101, "q0 new", "a0 new")]
+    assert top(retriever, 0)[0][0] != 101
+    assert top(retriever, 6, language="ta") == [(105, "q5", "a5")]
+
+    retriever.delete([103, 999])
+    assert len(retriever) == 4
+    assert all(hit[0] != 103 for hit in retriever.search(basis(2)[None, :], top_k=10)[0])
+    # The partition still lists 103's label until compaction; the tombstone keeps it out
+    assert [hit[0] for hit in retriever.search(basis(2)[None, :], top_k=10, filters={"language": "te"})[0]] == [101]
+
+
+def test_compact_removes_tombstones(store):
+    retriever = IncrementalFaissRetriever.from_store(store)
+    retriever.upsert([102], ["q1 new"], ["a1 new"], basis(7)[None, :], languages=["hi"], categories=["rice"])
+    retriever.delete([104])
+    assert retriever.compact() == 2
+    assert retriever.index.ntotal == 3 and retriever.tombstone_ratio() == 0.0
+    assert retriever.compact() == 0
+    assert top(retriever, 7, language="hi") == [(102, "q1 new", "a1 new")]
+    assert top(retriever, 0, category="cotton") == []
+
+
+def test_deleting_a_whole_partition_matches_nothing(store):
+    retriever = IncrementalFaissRetriever.from_store(store)
+    retriever.delete([102, 104])
+    assert top(retriever, 1, language="hi") == []
+
+
+def test_apply_changes(store):
+    retriever = IncrementalFaissRetriever.from_store(store)
+    assert retriever.apply_changes([]) == 0 and retriever.change_cursor == 0
+    changes = [
+        # (change_id, kb_id, question, answer, embedding, language, category)
+        (1, 105, "q5", "a5", vector_literal(basis(5)), "te", None),
+        (2, 105, "q5 v2", "a5 v2", vector_literal(basis(6)), "te", None),   # later change of 105 wins
+        (3, 102, None, None, None, None, None),                             # row gone
+    ]
+    assert retriever.apply_changes(changes) == 2
+    assert retriever.change_cursor == 3 and retriever.is_applied(2)
+    assert top(retriever, 6) == [(105, "q5 v2", "a5 v2")]
+    assert 102 not in retriever.label_of
+    # Replaying the overlap window changes nothing
+    retriever.apply_changes(changes[2:])
+    assert len(retriever) == 4
+
+
+def test_incremental_retriever_starts_empty():
+    retriever = IncrementalFaissRetriever(dimension=0)
+    assert retriever.search(basis(0)[None, :]) == [[]]
+    retriever.upsert([1], ["q"], ["a"], basis(0)[None, :])
+    assert top(retriever, 0) == [(1, "q", "a")]
+
+
+def test_store_partitions_read_in_blocks(store):
+    partitions = store_partitions(store, block_rows=3)
+    np.testing.assert_array_equal(partitions.positions({"language": "te"}), [0, 2])
+    np.testing.assert_array_equal(partitions.positions({"language": "hi", "category": "rice"}), [1])
+    assert partitions.positions({"category": "wheat"}).size == 0
+    assert partitions.positions({"region": "south"}) is None
+
+
+def test_partition_cache_only_holds_existing_values():
+    partitions = Partitions.from_columns({"language": ["te", "hi", "te"]})
+    for value in ("ta", "kn", "mr", "te"):
+        partitions.positions({"language": value})
+    assert list(partitions._cache) == [(("language", "te"),)]
+    partitions.discard(np.array([0]))
+    np.testing.assert_array_equal(partitions.positions({"language": "te"}), [2])
@@ -0,0 +1,45 @@
+# test_snapshots.py
+# Publishing and pruning versioned artifact snapshots (snapshots.py)
+import pytest
+
+from snapshots import (current_version, list_snapshots, new_snapshot_dir, prune_snapshots, publish_snapshot,
+                       resolve_snapshot)
+
+
+def test_nothing_published_resolves_to_the_flat_layout(tmp_path):
+    assert current_version(tmp_path) is None
+    assert resolve_snapshot(tmp_path) == tmp_path
+
+
+def test_publish_switches_current(tmp_path):
+    first = new_snapshot_dir(tmp_path, "v1")
+    second = new_snapshot_dir(tmp_path, "v1")
+    assert second.name == "v1-1"
+
+    assert publish_snapshot(tmp_path, first) == "v1"
+    assert resolve_snapshot(tmp_path) == first
+    publish_snapshot(tmp_path, second)
+    assert current_version(tmp_path) == "v1-1" and resolve_snapshot(tmp_path) == second
+    assert resolve_snapshot(tmp_path, "v1") == first
+    assert not (tmp_path / "CURRENT.tmp").exists()
+
+
+def test_publish_refuses_directories_outside_snapshots(tmp_path):
+    stray = tmp_path / "elsewhere" / "v1"
+    stray.mkdir(parents=True)
+    with pytest.raises(FileNotFoundError):
+        publish_snapshot(tmp_path, stray)
+    assert current_version(tmp_path) is None
+    with pytest.raises(FileNotFoundError):
+        resolve_snapshot(tmp_path, "v9")
+
+
+def test_prune_keeps_the_newest_and_the_active_snapshot(tmp_path):
+    for version in ("v1", "v2", "v3", "v4", "v5"):
+        new_snapshot_dir(tmp_path, version)
+    # Rolled back to an old snapshot: it survives pruning even though it isn't among the newest
+    publish_snapshot(tmp_path, tmp_path / "snapshots" / "v2")
+    assert prune_snapshots(tmp_path, keep=3) == ["v1", "v3"]
+    assert list_snapshots(tmp_path) == ["v2", "v4", "v5"]
+    assert prune_snapshots(tmp_path, keep=1) == ["v4", "v5"]
+    assert list_snapshots(tmp_path) == ["v2"]